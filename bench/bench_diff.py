@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+import os, os.path
+import random
+import sys
+import timeit
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from noodle import Module, Section, Site, Diff, diff_seq
+
+
+def legacy_lcs(S1, S2):
+    # the table-based lcs noodle used before diff_seq, for comparison
+    m, n = len(S1), len(S2)
+    table = [ [ 0 for x in range(n+1) ] for x in range(m+1) ]
+    for i in range(1, m+1):
+        for j in range(1, n+1):
+            if S1[i-1] == S2[j-1]:
+                table[i][j] = table[i-1][j-1] + 1
+            else:
+                table[i][j] = max(table[i-1][j], table[i][j-1])
+    lcs = []
+    while m > 0 and n > 0:
+        if S1[m-1] == S2[n-1]:
+            lcs.insert(0, S1[m-1])
+            m -= 1
+            n -= 1
+        elif table[m-1][n] > table[m][n-1]:
+            m -= 1
+        else:
+            n -= 1
+    return lcs
+
+
+def legacy_align(S1, S2):
+    # lcs plus the membership scans Diff and DiffSec used to do
+    lcs = legacy_lcs(S1, S2)
+    ret = []
+    for i in range(max(len(S1), len(S2))):
+        if i < len(S1) and S1[i] not in lcs:
+            ret.append((1, S1[i]))
+        if i < len(S2) and S2[i] not in lcs:
+            ret.append((2, S2[i]))
+    return ret
+
+
+def make_module(i, rev=0):
+    return Module(
+        f'Lecture {i}',
+        f'Slides and notes for lecture {i}, revision {rev}',
+        'File',
+        f'https://moodle.example/mod/resource/view.php?id={i}',
+        (f'https://moodle.example/pluginfile.php/{i}/mod_resource/content/{rev}/lecture{i}.pdf',)
+    )
+
+
+def make_site(sections):
+    return Site('Benchmark', 'BENCH101', sections)
+
+
+def churn(modules, changes, rng):
+    # revise, drop and insert a few modules at random positions
+    modules = list(modules)
+    for n in range(changes):
+        i = rng.randrange(len(modules))
+        action = n % 3
+        if action == 0:
+            modules[i] = make_module(i, rev=n + 1)
+        elif action == 1:
+            modules.pop(i)
+        else:
+            modules.insert(i, make_module(10**6 + n))
+    return modules
+
+
+def main():
+    rng = random.Random(235)
+    now = datetime.now()
+
+    print(f"{'modules':>8} {'changes':>8} {'legacy':>10} {'diff_seq':>10} {'Diff':>10}")
+    for size in (100, 300, 1000):
+        for changes in (3, 30):
+            prev = [ make_module(i) for i in range(size) ]
+            curr = churn(prev, changes, rng)
+            site_a = make_site([ Section('Week 1', None, prev) ])
+            site_b = make_site([ Section('Week 1', None, curr) ])
+
+            number = 3
+            legacy = timeit.timeit(lambda: legacy_align(prev, curr), number=number) / number
+            myers = timeit.timeit(lambda: diff_seq(prev, curr), number=number) / number
+            whole = timeit.timeit(lambda: Diff(site_b, site_a, now, now), number=number) / number
+            print(f'{size:>8} {changes:>8} {legacy * 1000:>8.1f}ms {myers * 1000:>8.1f}ms {whole * 1000:>8.1f}ms')
+
+    # sections against sections, where every comparison used to rehash
+    print()
+    print(f"{'sections':>8} {'modules':>8} {'Diff':>10} {'memory':>10}")
+    for count in (20, 60):
+        tracemalloc.start()
+        prev = [ Section(f'Week {i}', None, [ make_module(i * 100 + j) for j in range(50) ]) for i in range(count) ]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        curr = list(prev)
+        curr[count // 2] = Section(f'Week {count // 2}', None, churn(prev[count // 2].modules, 3, rng))
+        site_a, site_b = make_site(prev), make_site(curr)
+
+        number = 3
+        whole = timeit.timeit(lambda: Diff(site_b, site_a, now, now), number=number) / number
+        print(f'{count:>8} {count * 50:>8} {whole * 1000:>8.1f}ms {size / 2**10:>8.0f}KB')
+
+
+if __name__ == '__main__':
+    main()
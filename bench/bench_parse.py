@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import os, os.path
+import sys
+import timeit
+
+from lxml import html
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import noodle_selectors as sel
+from noodle import parse_site
+
+
+def synthetic_course(sections=12, modules=20) -> bytes:
+    # boost-like course page with a script-heavy footer, as saved html
+    # pages from moodle tend to be
+    out = [ '<!DOCTYPE html><html><head><title>Course</title></head><body>' ]
+    out.append('<div id="page-wrapper"><div id="page"><div id="page-header"><header>')
+    out.append('<h1>BENCH101 Benchmark Course</h1><nav><a aria-current="page" href="#">BENCH101</a></nav>')
+    out.append('</header></div><div id="region-main"><ul class="topics">')
+    for s in range(sections):
+        out.append(f'<li role="region" class="section"><div class="content"><h3>Week {s}</h3>')
+        out.append(f'<div class="summary"><div><div>Topics for week {s}</div></div></div><ul class="section">')
+        for m in range(modules):
+            out.append(f'<li class="activity"><div><div class="activityinstance">')
+            out.append(f'<a class="aalink" href="https://moodle.example/mod/resource/view.php?id={s * 100 + m}">')
+            out.append(f'<span class="instancename">Lecture {m}<span class="accesshide "> File</span></span></a></div>')
+            out.append(f'<div class="contentafterlink"><div class="no-overflow"><p>Notes for lecture {m}</p></div></div></div></li>')
+        out.append('</ul></div></li>')
+    out.append('</ul></div></div></div><footer id="page-footer"><div class="footer">')
+    out.append('<script>' + 'var M = M || {}; M.cfg = {"sesskey": "x"};' * 2000 + '</script>' * 1)
+    out.append('<ul>' + '<li><a href="#">link</a></li>' * 500 + '</ul>')
+    out.append('</div></footer></body></html>')
+    return ''.join(out).encode()
+
+
+def main():
+    # saved course pages can be passed as arguments
+    pages = {}
+    for path in sys.argv[1:]:
+        with open(path, 'rb') as f:
+            pages[os.path.basename(path)] = f.read()
+    if not pages:
+        pages['synthetic'] = synthetic_course()
+
+    print(f"{'page':>16} {'size':>8} {'document':>10} {'region':>10} {'site':>10}")
+    for name, content in pages.items():
+        number = 20
+        document = timeit.timeit(lambda: html.fromstring(content), number=number) / number
+        region = timeit.timeit(lambda: sel.parse_page(content), number=number) / number
+        tree = sel.parse_page(content)
+        site = timeit.timeit(lambda: parse_site(tree), number=number) / number
+        print(f'{name[:16]:>16} {len(content) / 2**10:>6.0f}KB {document * 1000:>8.2f}ms {region * 1000:>8.2f}ms {site * 1000:>8.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import copy
+import random
+
+# module kinds as moodle labels them, with the url path of their page
+KINDS = {
+    'File': 'resource',
+    'Folder': 'folder',
+    'Assignment': 'assign',
+    'Page': 'page',
+    'URL': 'url',
+    'Forum': 'forum'
+}
+
+WORDS = (
+    'lecture', 'tutorial', 'lab', 'notes', 'slides', 'reading', 'quiz', 'project',
+    'review', 'solutions', 'exercise', 'week', 'chapter', 'introduction', 'summary'
+)
+
+
+def phrase(rng, words=4) -> str:
+    return ' '.join(rng.choice(WORDS) for i in range(words)).capitalize()
+
+
+def make_module(rng, mid):
+    kind = rng.choice(list(KINDS))
+    files = []
+    if kind in ('File', 'Assignment'):
+        files = [ f'{phrase(rng, 2).replace(" ", "_")}_{mid}.pdf' ]
+    elif kind == 'Folder':
+        files = [ f'{phrase(rng, 2).replace(" ", "_")}_{mid}_{i}.pdf' for i in range(rng.randint(1, 5)) ]
+    return {
+        'id': mid,
+        'kind': kind,
+        'title': f'{phrase(rng, 3)} {mid}',
+        'desc': phrase(rng, 12) if rng.random() < 0.6 else None,
+        'files': files,
+        'rev': 1,
+        'size': rng.randint(2**12, 2**18)
+    }
+
+
+def generate(sites=10, sections=10, modules=15, seed=0) -> dict:
+    # courses keyed by course id; module ids are unique across courses
+    rng = random.Random(seed)
+    courses = {}
+    next_id = 1000
+    for cid in range(1, sites + 1):
+        course = {
+            'id': cid,
+            'code': f'BENCH{100 + cid}',
+            'title': f'{phrase(rng, 3)} {cid}',
+            'sections': []
+        }
+        for s in range(sections):
+            section = {
+                'title': f'Week {s + 1}',
+                'summary': phrase(rng, 8) if rng.random() < 0.5 else None,
+                'modules': []
+            }
+            for m in range(rng.randint(max(1, modules // 2), modules + modules // 2)):
+                section['modules'].append(make_module(rng, next_id))
+                next_id += 1
+            course['sections'].append(section)
+        courses[cid] = course
+    return courses
+
+
+def churn(courses, sites=0.1, modules=0.05, seed=1) -> dict:
+    # next revision: a share of the courses change, and in those a share
+    # of the modules get edited, added, removed or re-uploaded
+    rng = random.Random(seed)
+    courses = copy.deepcopy(courses)
+    next_id = 1 + max(m['id'] for c in courses.values() for s in c['sections'] for m in s['modules'])
+    for course in courses.values():
+        if rng.random() >= sites:
+            continue
+        for section in course['sections']:
+            for i in reversed(range(len(section['modules']))):
+                if rng.random() >= modules:
+                    continue
+                action = rng.randrange(4)
+                if action == 0:
+                    section['modules'][i]['desc'] = phrase(rng, 12)
+                elif action == 1:
+                    section['modules'].insert(i + 1, make_module(rng, next_id))
+                    next_id += 1
+                elif action == 2 and len(section['modules']) > 1:
+                    section['modules'].pop(i)
+                else:
+                    section['modules'][i]['rev'] += 1
+    return courses
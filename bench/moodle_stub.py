@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+
+import json
+import os, os.path
+import sys
+import threading
+from hashlib import md5
+from email.utils import formatdate
+from html import escape
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, quote, unquote
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from generate import KINDS, generate
+
+
+def render_course(base, course) -> bytes:
+    # same landmarks as a boost themed moodle course page
+    out = [ '<!DOCTYPE html><html><head><title>Course</title></head><body>' ]
+    out.append('<div id="page-wrapper"><div id="page"><div id="page-header"><header>')
+    out.append(f'<h1>{course["code"]} {escape(course["title"])}</h1>')
+    out.append(f'<nav><a aria-current="page" href="{base}/course/view.php?id={course["id"]}">{course["code"]}</a></nav>')
+    out.append('</header></div><div id="region-main"><ul class="topics">')
+    for section in course['sections']:
+        out.append(f'<li role="region" class="section main"><div class="content"><h3 class="sectionname"><span>{escape(section["title"])}</span></h3>')
+        summary = f'<div><div>{escape(section["summary"])}</div></div>' if section['summary'] else ''
+        out.append(f'<div class="summary">{summary}</div><ul class="section img-text">')
+        for module in section['modules']:
+            href = f'{base}/mod/{KINDS[module["kind"]]}/view.php?id={module["id"]}'
+            out.append('<li class="activity"><div><div class="mod-indent-outer"><div class="activityinstance">')
+            out.append(f'<a class="aalink" href="{href}"><span class="instancename">{escape(module["title"])}')
+            out.append(f'<span class="accesshide "> {module["kind"]}</span></span></a></div>')
+            if module['desc']:
+                out.append(f'<div class="contentafterlink"><div class="no-overflow"><p>{escape(module["desc"])}</p></div></div>')
+            out.append('</div></div></li>')
+        out.append('</ul></div></li>')
+    out.append('</ul></div></div></div>')
+    out.append('<footer id="page-footer"><div class="footer">')
+    out.append('<script>M.cfg = {"sesskey": "%s"};</script>' % os.urandom(5).hex())
+    out.append('<ul>' + '<li><a href="#">Help and documentation</a></li>' * 50 + '</ul>')
+    out.append('</div></footer></body></html>')
+    return ''.join(out).encode()
+
+
+def file_url(base, module, name) -> str:
+    return f'{base}/pluginfile.php/{module["id"]}/mod_{KINDS[module["kind"]]}/content/{module["rev"]}/{quote(name)}'
+
+
+def render_module(base, module) -> bytes:
+    links = ''.join(f'<a href="{file_url(base, module, name)}?forcedownload=1">{escape(name)}</a>' for name in module['files'])
+    if module['kind'] == 'Folder':
+        main = f'<div class="filemanager">{links}</div>'
+    else:
+        main = links
+    if module['kind'] == 'Assignment':
+        main += f'<a href="{base}/pluginfile.php/{module["id"]}/assignsubmission_file/submission_files/1/mine.pdf">mine</a>'
+    # session keys and generated ids differ on every request, as on moodle
+    nav = f'<nav id="yui_{os.urandom(4).hex()}"><a href="{base}/login/logout.php?sesskey={os.urandom(5).hex()}">Log out</a></nav>'
+    return f'<!DOCTYPE html><html><body>{nav}<section id="region-main"><div role="main">{main}</div></section></body></html>'.encode()
+
+
+def render_contents(base, course) -> bytes:
+    # core_course_get_contents, with the fields noodle reads
+    sections = []
+    for section in course['sections']:
+        modules = []
+        for module in section['modules']:
+            modname = KINDS[module['kind']]
+            url = file_url(base, module, '').replace('/pluginfile.php/', '/webservice/pluginfile.php/')
+            modules.append({
+                'id': module['id'],
+                'name': module['title'],
+                'modname': modname,
+                'url': f'{base}/mod/{modname}/view.php?id={module["id"]}',
+                'visible': 1,
+                'uservisible': True,
+                'description': f'<p>{escape(module["desc"])}</p>' if module['desc'] else None,
+                'contents': [
+                    { 'type': 'file', 'filename': name, 'filesize': module['size'], 'fileurl': f'{url}{quote(name)}?forcedownload=1' }
+                    for name in module['files']
+                ]
+            })
+        sections.append({
+            'name': section['title'],
+            'summary': f'<div>{escape(section["summary"])}</div>' if section['summary'] else '',
+            'modules': modules
+        })
+    return json.dumps(sections).encode()
+
+
+def file_data(module, name) -> bytes:
+    # deterministic bytes of the module's file size for each revision
+    seed = md5(f'{module["id"]}/{module["rev"]}/{name}'.encode()).digest()
+    return (seed * (module['size'] // len(seed) + 1))[:module['size']]
+
+
+class MoodleStub:
+    def __init__(self, courses, port=0):
+        self.courses = courses
+        self.lock = threading.Lock()
+        self.sessions = set()
+        self.tokens = set()
+        self.reset()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stub.handle(self, body=True)
+
+            def do_HEAD(self):
+                stub.handle(self, body=False)
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                if path == '/login/token.php':
+                    stub.handle_token(self)
+                elif path == '/webservice/rest/server.php':
+                    stub.handle_ws(self)
+                else:
+                    stub.handle_login(self)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.base = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self.lock:
+            self.requests = {}
+            self.bytes = 0
+
+    def expire(self):
+        # drop every login session, as moodle does after a timeout
+        with self.lock:
+            self.sessions.clear()
+
+    def count(self, kind, size):
+        with self.lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+            self.bytes += size
+
+    def module(self, mid):
+        for course in self.courses.values():
+            for section in course['sections']:
+                for module in section['modules']:
+                    if module['id'] == mid:
+                        return module
+        return None
+
+    def send(self, req, kind, status, body=b'', headers={}, head=False):
+        req.send_response(status)
+        for key, value in headers.items():
+            req.send_header(key, value)
+        req.send_header('Content-Length', str(len(body)))
+        req.end_headers()
+        if not head:
+            req.wfile.write(body)
+        self.count(kind, 0 if head else len(body))
+
+    def send_page(self, req, kind, body, head=False):
+        # like moodle's view.php: no etag, and the time of the request as
+        # last-modified, so conditional requests always get the full page
+        headers = {
+            'Content-Type': 'text/html; charset=utf-8',
+            'Cache-Control': 'no-store, no-cache, must-revalidate',
+            'Last-Modified': formatdate(usegmt=True)
+        }
+        self.send(req, kind, 200, body, headers, head)
+
+    def handle_login(self, req):
+        req.rfile.read(int(req.headers.get('Content-Length', 0)))
+        token = os.urandom(8).hex()
+        with self.lock:
+            self.sessions.add(token)
+        headers = { 'Set-Cookie': f'MoodleSession={token}; Path=/', 'Location': f'{self.base}/my/' }
+        self.send(req, 'login', 303, headers=headers)
+
+    def issue_token(self) -> str:
+        token = os.urandom(16).hex()
+        with self.lock:
+            self.tokens.add(token)
+        return token
+
+    def handle_token(self, req):
+        req.rfile.read(int(req.headers.get('Content-Length', 0)))
+        body = json.dumps({ 'token': self.issue_token() }).encode()
+        self.send(req, 'token', 200, body, { 'Content-Type': 'application/json' })
+
+    def handle_ws(self, req):
+        # the rest server answers errors with an exception object
+        params = { k: v[0] for k, v in parse_qs(req.rfile.read(int(req.headers.get('Content-Length', 0))).decode()).items() }
+        function = params.get('wsfunction')
+        data = None
+        if params.get('wstoken') not in self.tokens:
+            data = { 'exception': 'moodle_exception', 'errorcode': 'invalidtoken', 'message': 'Invalid token - token not found' }
+        elif function == 'core_webservice_get_site_info':
+            data = { 'userid': 2, 'fullname': 'bench user' }
+        elif function == 'core_enrol_get_users_courses':
+            data = [
+                { 'id': c['id'], 'shortname': c['code'], 'fullname': f'{c["code"]} {c["title"]}' }
+                for c in self.courses.values()
+            ]
+        elif function == 'core_course_get_contents':
+            course = self.courses.get(int(params.get('courseid', 0)))
+            if course is not None:
+                return self.send(req, 'ws', 200, render_contents(self.base, course), { 'Content-Type': 'application/json' })
+        if data is None:
+            data = { 'exception': 'invalid_parameter_exception', 'errorcode': 'invalidparameter', 'message': 'Invalid parameter value detected' }
+        self.send(req, 'ws', 200, json.dumps(data).encode(), { 'Content-Type': 'application/json' })
+
+    def authenticated(self, req) -> bool:
+        for cookie in req.headers.get('Cookie', '').split(';'):
+            key, _, value = cookie.strip().partition('=')
+            if key == 'MoodleSession' and value in self.sessions:
+                return True
+        return False
+
+    def handle(self, req, body=True):
+        url = urlparse(req.path)
+        query = parse_qs(url.query)
+        head = not body
+
+        if url.path == '/login/index.php':
+            page = b'<html><body><form><input name="logintoken" value="stub"></form></body></html>'
+            return self.send_page(req, 'login', page, head)
+
+        # everything else needs a session, like moodle
+        if not self.authenticated(req):
+            headers = { 'Location': f'{self.base}/login/index.php' }
+            return self.send(req, 'redirect', 303, headers=headers, head=head)
+
+        if url.path == '/my/':
+            courses = ''.join(
+                f'<div id="course-{c["id"]}"><strong><a href="{self.base}/course/view.php?id={c["id"]}">'
+                f'{c["code"]} {escape(c["title"])}</a></strong><small>{c.get("type", "Subject")}</small></div>'
+                for c in self.courses.values()
+            )
+            page = f'<html><body><span class="usertext mr-1">bench user</span><div id="courses">{courses}</div></body></html>'
+            return self.send_page(req, 'dashboard', page.encode(), head)
+
+        if url.path == '/course/view.php':
+            course = self.courses.get(int(query.get('id', [ 0 ])[0]))
+            if course is not None:
+                return self.send_page(req, 'course', render_course(self.base, course), head)
+
+        if url.path.startswith('/mod/'):
+            module = self.module(int(query.get('id', [ 0 ])[0]))
+            if module is not None:
+                return self.send_page(req, 'module', render_module(self.base, module), head)
+
+        if url.path.startswith('/pluginfile.php/'):
+            parts = url.path.split('/')
+            module = self.module(int(parts[2]))
+            name = unquote(parts[-1])
+            if module is not None and name in module['files']:
+                return self.send_file(req, module, name, head)
+
+        self.send(req, 'missing', 404, b'not found', head=head)
+
+    def send_file(self, req, module, name, head):
+        data = file_data(module, name)
+        etag = '"%s-%d"' % (module['id'], module['rev'])
+        headers = { 'Content-Type': 'application/pdf', 'ETag': etag, 'Accept-Ranges': 'bytes' }
+        if req.headers.get('If-None-Match') == etag:
+            return self.send(req, 'file', 304, headers={ 'ETag': etag })
+
+        # single byte ranges for resumed downloads, of the current revision
+        ranges = req.headers.get('Range', '')
+        current = req.headers.get('If-Range', etag) == etag
+        if ranges.startswith('bytes=') and ranges.endswith('-') and current:
+            start = int(ranges[6:-1])
+            if start >= len(data):
+                return self.send(req, 'file', 416, headers={ 'Content-Range': f'bytes */{len(data)}' })
+            headers['Content-Range'] = f'bytes {start}-{len(data) - 1}/{len(data)}'
+            return self.send(req, 'file', 206, data[start:], headers, head)
+
+        self.send(req, 'file', 200, data, headers, head)
+
+
+if __name__ == '__main__':
+    # serve a generated set of courses until interrupted
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    stub = MoodleStub(generate(), port)
+    print(f'[*] Serving stand-in Moodle at {stub.base}')
+    stub.server.serve_forever()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os, os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from base64 import b64encode
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import repeat
+
+import pygit2
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH)
+
+import noodle
+import noodle_selectors as sel
+from generate import KINDS, generate, churn
+from moodle_stub import MoodleStub, render_course, render_module
+
+
+def run_noodle(workdir, args=()) -> dict:
+    # run noodle.py as cron would, collecting wall time and peak rss
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [ sys.executable, os.path.join(workdir, 'noodle.py'), *args ],
+        cwd=workdir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+    )
+    output = proc.stdout.read()
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - start
+
+    if proc.returncode != 0:
+        sys.stdout.write(output.decode(errors='replace'))
+        raise SystemExit(f'[-] noodle.py exited with {proc.returncode}')
+
+    # ru_maxrss is in kilobytes on linux
+    return { 'time': elapsed, 'rss': usage.ru_maxrss * 2**10 }
+
+
+def build_sites(stub) -> list:
+    # parse every course and module page the way noodle would
+    sites = []
+    for course in stub.courses.values():
+        tree = sel.parse_page(render_course(stub.base, course))
+        site = noodle.parse_site(tree)
+        links = {}
+        for module in site.modules():
+            if module.pending():
+                mid = int(module.href.split('id=')[1])
+                links[module.href] = noodle.parse_links(sel.parse_page(render_module(stub.base, stub.module(mid))))
+        sites.append(site.resolve(links))
+    return sites
+
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def phases(stub, prev_courses) -> dict:
+    # per-phase cost on the current and previous revision, in process
+    ret = {}
+    sites = build_sites(stub)
+    pages = [ render_course(stub.base, course) for course in stub.courses.values() ]
+    ret['parse'] = timed(lambda: [ noodle.parse_site(sel.parse_page(page)) for page in pages ])
+
+    # previous revision for diffs
+    courses, stub.courses = stub.courses, prev_courses
+    prevs = build_sites(stub)
+    stub.courses = courses
+
+    now = datetime.now().astimezone()
+    ret['diff'] = timed(lambda: [ noodle.Diff(site, prev, now, now) for site, prev in zip(sites, prevs) ])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        def commit():
+            repo = pygit2.init_repository(os.path.join(tmp, 'json'), False)
+            tree = repo.TreeBuilder()
+            for site in sites:
+                tree.insert(site.code + '.json', repo.create_blob(noodle.dump_site(site)), pygit2.GIT_FILEMODE_BLOB)
+            signature = pygit2.Signature('noodle', 'noodle@localhost')
+            repo.create_commit('refs/heads/master', signature, signature, '', tree.write(), [])
+        ret['commit'] = timed(commit)
+
+        def markdown():
+            for site, prev in zip(sites, prevs):
+                site.write_markdown(os.path.join(tmp, site.code + '.md'))
+                noodle.Diff(site, prev, now, now).write_markdown(os.path.join(tmp, site.code + '.diff.md'))
+        ret['markdown'] = timed(markdown)
+
+    return ret
+
+
+def stages(run_map, pages, modules, prevs, now) -> list:
+    # parse and render every site the way the pipeline does, with the
+    # heavy steps mapped by run_map
+    parsed = list(run_map(noodle.parse_course, pages, repeat(None)))
+    hrefs = [ href for href, page in modules ]
+    links = dict(zip(hrefs, run_map(noodle.parse_page_links, [ page for href, page in modules ])))
+    sites = [ noodle.build_site(snapshot).resolve(links) for fp, snapshot in parsed ]
+    datas = [ prevs.get(site.code) for site in sites ]
+    return list(run_map(noodle.render_site, [ site.snapshot() for site in sites ], datas, repeat(now), repeat(now)))
+
+
+def processes(stub, prev_courses, workers) -> dict:
+    # parse and render on one core and on a process pool; the outputs
+    # must be byte-identical
+    pages = [ render_course(stub.base, course) for course in stub.courses.values() ]
+    modules = []
+    for course in stub.courses.values():
+        for section in course['sections']:
+            for module in section['modules']:
+                if module['kind'] in ('File', 'Folder', 'Assignment'):
+                    href = f'{stub.base}/mod/{KINDS[module["kind"]]}/view.php?id={module["id"]}'
+                    modules.append((href, render_module(stub.base, module)))
+
+    courses, stub.courses = stub.courses, prev_courses
+    prevs = { site.code: noodle.dump_site(site) for site in build_sites(stub) }
+    stub.courses = courses
+    now = datetime.now().astimezone()
+
+    ret = {}
+    start = time.perf_counter()
+    serial = stages(map, pages, modules, prevs, now)
+    ret['serial'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        ret['startup'] = timed(lambda: list(pool.map(abs, range(workers))))
+        parallel = stages(lambda func, *args: pool.map(func, *args, chunksize=4), pages, modules, prevs, now)
+    ret['parallel'] = time.perf_counter() - start - ret['startup']
+
+    if parallel != serial:
+        raise SystemExit('[-] Process pool output differs from the serial path')
+    return ret
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end noodle benchmark against a stand-in Moodle.')
+    parser.add_argument('--sites', type=int, default=10)
+    parser.add_argument('--sections', type=int, default=10)
+    parser.add_argument('--modules', type=int, default=15, help='modules per section on average')
+    parser.add_argument('--runs', type=int, default=3, help='runs after the initial one, each on a new revision')
+    parser.add_argument('--churn-sites', type=float, default=0.1, help='share of sites changing per revision')
+    parser.add_argument('--churn-modules', type=float, default=0.05, help='share of modules changing in a changed site')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=0, help='requests per second, 0 for no limit')
+    parser.add_argument('--processes', type=int, default=0, help='parse and render on this many processes, 0 for none')
+    parser.add_argument('--ws', action='store_true', help='read courses through web services instead of pages')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--keep', action='store_true', help='keep the work dir')
+    args = parser.parse_args()
+
+    courses = generate(args.sites, args.sections, args.modules, args.seed)
+    stub = MoodleStub(courses).start()
+    workdir = tempfile.mkdtemp(prefix='noodle-bench-')
+
+    # a private copy of noodle, so its json/, markdown/ and download/ land here
+    for path in glob.glob(os.path.join(ROOT, 'noodle*.py')):
+        shutil.copy(path, workdir)
+    config = {
+        'login': b64encode(b'bench:bench').decode('ascii'),
+        'moodle': stub.base,
+        'workers': args.workers,
+        'rate': args.rate,
+        'processes': args.processes,
+        'sites': [ { 'name': c['code'], 'href': f'{stub.base}/course/view.php?id={c["id"]}' } for c in courses.values() ]
+    }
+    if args.ws:
+        config['token'] = stub.issue_token()
+    with open(os.path.join(workdir, 'config.json'), 'w') as f:
+        json.dump(config, f, indent=4)
+
+    results = []
+    print(f"{'run':>4} {'time':>8} {'requests':>9} {'bytes':>10} {'rss':>8}")
+    prev = courses
+    for run in range(args.runs + 1):
+        if run > 0:
+            prev = stub.courses
+            stub.courses = churn(stub.courses, args.churn_sites, args.churn_modules, args.seed + run)
+        stub.reset()
+        result = run_noodle(workdir)
+        result['requests'] = dict(stub.requests)
+        result['bytes'] = stub.bytes
+        with open(os.path.join(workdir, 'metrics', 'report.json')) as f:
+            result['report'] = json.load(f)
+        results.append(result)
+        print(f"{run:>4} {result['time']:>7.2f}s {sum(stub.requests.values()):>9} "
+              f"{stub.bytes / 2**20:>8.1f}MB {result['rss'] / 2**20:>6.1f}MB")
+
+    # per-phase costs on the final revision
+    costs = phases(stub, prev)
+    print()
+    print(' '.join(f'{name}: {cost * 1000:.1f}ms' for name, cost in costs.items()))
+
+    # parse and render speedup on a process pool
+    speedup = None
+    if args.processes > 0:
+        speedup = processes(stub, prev, args.processes)
+        print(f"serial: {speedup['serial'] * 1000:.1f}ms {args.processes} processes: {speedup['parallel'] * 1000:.1f}ms "
+              f"(x{speedup['serial'] / speedup['parallel']:.2f}, startup {speedup['startup'] * 1000:.1f}ms)")
+
+    stub.stop()
+    if args.keep:
+        print(f'[*] Work dir kept at {workdir}')
+    else:
+        shutil.rmtree(workdir)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({ 'args': vars(args), 'runs': results, 'phases': costs, 'processes': speedup }, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
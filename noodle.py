@@ -1,114 +1,142 @@
 #!/usr/bin/env python3
 
+import argparse
+import glob
+import importlib.util
+import io
 import json
+import multiprocessing
 import os, os.path
+import re
 import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime
-from urllib.parse import unquote
+from urllib.parse import unquote, urlparse
 from base64 import b64decode
+from hashlib import sha1
 
-import jsonpickle
-import pygit2
-import requests
 from lxml import html
 
-class Module:
-    def __init__(self, tree):
-        # set resource tree; shift to aalink subtree if it exists
-        res_tree = tree.xpath('.//div[@class="activityinstance"]')[0]
-        aalink = res_tree.xpath('.//a[@class="aalink"]')
-        if aalink: res_tree = aalink[0]
+import noodle_selectors as sel
+import noodle_snapshot
+from noodle_cache import Cache
+from noodle_metrics import Metrics, profile
+
+
+def lazy(name):
+    # module loaded on first use; listing and rendering never pay for
+    # requests, and listing not for pygit2 either
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+pygit2 = lazy('pygit2')
+requests = lazy('requests')
+noodle_archive = lazy('noodle_archive')
+noodle_download = lazy('noodle_download')
+noodle_history = lazy('noodle_history')
+noodle_http = lazy('noodle_http')
+noodle_ws = lazy('noodle_ws')
+
+
+class Frozen:
+    # immutable value type; fields are the subclass slots and the hash
+    # is computed once, so nested comparisons stay cheap
+    __slots__ = ('_hash',)
+
+    def __init__(self, *values):
+        for field, value in zip(self.__slots__, values):
+            object.__setattr__(self, field, value)
+        object.__setattr__(self, '_hash', hash(values))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __reduce__(self):
+        return type(self), self.values()
+
+    def values(self) -> tuple:
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def snapshot(self) -> dict:
+        ret = {}
+        for field in self.__slots__:
+            value = getattr(self, field)
+            if isinstance(value, tuple):
+                value = [ v.snapshot() if isinstance(v, Frozen) else v for v in value ]
+            ret[field] = value
+        return ret
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __eq__(self, other) -> bool:
+        if self is other:
+            return True
+        if type(self) is not type(other) or self._hash != other._hash:
+            return False
+        return self.values() == other.values()
 
-        # set module title
-        text = res_tree.xpath('.//text()')
-        self.title = text.pop(0).strip()
 
-        # set description if any
-        desc_tree = tree.xpath('.//div[@class="contentafterlink"]')
-        desc = desc_tree[0].xpath('.//div/text() | .//p//text() | .//ul/li//text()') if len(desc_tree) > 0 else None
-        self.desc = ' '.join(desc[0].split()) if desc is not None else None
+class Module(Frozen):
+    __slots__ = ('title', 'desc', 'tags', 'href', 'files', 'folder')
 
-        # set tags, aka the rest of the text()
-        tags = [ t.strip() for t in text ]
-        if res_tree.xpath('./div[contains(@class,"dimmed")]'):
-            tags.append("Restricted")
-        self.tags = ', '.join(tags)
+    def __init__(self, title, desc, tags, href, files=(), folder=()):
+        super().__init__(title, desc, tags, href, tuple(files), tuple(folder))
 
-        # set link to page
-        href = res_tree.xpath('./@href')
-        self.href = href[0].strip() if len(href) > 0 else '#'
+    def pending(self) -> bool:
+        if self.href == '#':
+            return False
+        return 'File' in self.tags or 'Assignment' in self.tags or 'Folder' in self.tags
 
+    def resolve(self, links):
         # set download-able files
         files = []
-        if ('File' in self.tags or 'Assignment' in self.tags) and self.href != '#':
-            page = sess.get(self.href)
-            tree = html.fromstring(page.content)
-            for link in tree.xpath('//section[@id="region-main"]/div[@role="main"]//a/@href'):
-                if 'pluginfile.php' in link and 'submission' not in link:
-                    files.append(link.split("?")[0])
-
-        # convert files to be immutable
-        self.files = tuple(files)
+        if 'File' in self.tags or 'Assignment' in self.tags:
+            files = links['files']
 
         # set folder sub files
         folder = []
-        if 'Folder' in self.tags and self.href != '#':
-            page = sess.get(self.href)
-            tree = html.fromstring(page.content)
-            for link in tree.xpath('//div[@class="filemanager"]//a/@href'):
-                if 'pluginfile.php' in link:
-                    folder.append(link.split("?")[0])
+        if 'Folder' in self.tags:
+            folder = links['folder']
 
-        # convert files to be immutable
-        self.folder = tuple(folder)
+        return Module(self.title, self.desc, self.tags, self.href, files, folder)
 
-    def __hash__(self) -> int:
-        return hash((self.title, self.desc, self.tags, self.href, self.files, self.folder))
 
-    def __eq__(self, other) -> bool:
-        return hash(self) == hash(other)
+class Section(Frozen):
+    __slots__ = ('title', 'desc', 'modules')
 
+    def __init__(self, title, desc, modules):
+        super().__init__(title, desc, tuple(modules))
 
-class Section:
-    def __init__(self, tree):
-        # set section title
-        self.title = tree.xpath('./h3//text()')[0].strip()
+    def resolve(self, links):
+        modules = [ m.resolve(links[m.href]) if m.pending() else m for m in self.modules ]
+        return Section(self.title, self.desc, modules)
 
-        # set description if any
-        desc_tree = tree.xpath('.//div[@class="summary"]')[0]
-        desc = desc_tree[0].xpath('.//div/text() | .//p//text() | .//ul/li//text()') if len(desc_tree) > 0 else None
-        self.desc = ' '.join(desc[0].split()) if desc is not None and len(desc) > 0 else None
 
-        # add modules
-        modules = []
-        for mod_tree in tree.xpath('./ul/li'):
-            modules.append(Module(mod_tree))
+class Site(Frozen):
+    __slots__ = ('title', 'code', 'sections')
 
-        # convert modules to be immutable
-        self.modules = tuple(modules)
+    def __init__(self, title, code, sections):
+        super().__init__(title, code, tuple(sections))
 
-    def __hash__(self) -> int:
-        return hash((self.title, self.desc, self.modules))
+    def resolve(self, links):
+        return Site(self.title, self.code, [ s.resolve(links) for s in self.sections ])
 
-    def __eq__(self, other) -> bool:
-        return hash(self) == hash(other)
-
-
-class Site:
-    def __init__(self, tree):
-        header = tree.xpath('./body/div/div/div/header')[0]
-        self.title = header.xpath('.//h1/text()')[0].split(' ', 1)[1].strip()
-        self.code = header.xpath('.//a[@aria-current="page"]/text()')[0].strip()
-        sections = []
-        for sec_tree in tree.xpath('//li[@role="region"]/div[@class="content"]'):
-            sections.append(Section(sec_tree))
-        self.sections = tuple(sections)
-
-    def __hash__(self) -> int:
-        return hash((self.title, self.code, self.sections))
-
-    def __eq__(self, other) -> bool:
-        return hash(self) == hash(other)
+    def modules(self) -> list:
+        ret = []
+        for section in self.sections:
+            ret += section.modules
+        return ret
 
     def files(self) -> list:
         ret = []
@@ -118,114 +146,305 @@ class Site:
                 ret += module.folder
         return ret
 
-    def write_markdown(self, file):
-        with open(file, 'w') as f:
-            # write site title and code
-            f.write(f'# {self.title}\n')
-            f.write(f'`{self.code}`\n')
-            f.write('\n')
+    def write_markdown(self, file) -> bool:
+        return write_text(file, self.markdown())
 
-            # write custom css style
-            f.write('<style>\nul > li > ul > li { font-size: 75%; }\n</style>\n')
-            f.write('\n')
+    def markdown(self) -> str:
+        f = io.StringIO()
 
-            for sec_code, section in enumerate(self.sections, start=1):
-                # write section title
-                f.write(f'## {section.title}\n')
+        # write site title and code
+        f.write(f'# {self.title}\n')
+        f.write(f'`{self.code}`\n')
+        f.write('\n')
 
-                # write section summary if any
-                if section.desc is not None:
-                    f.write(f'> {section.desc}\n')
-                    f.write('\n')
+        # write custom css style
+        f.write('<style>\nul > li > ul > li { font-size: 75%; }\n</style>\n')
+        f.write('\n')
+
+        for sec_code, section in enumerate(self.sections, start=1):
+            # write section title
+            f.write(f'## {section.title}\n')
 
-                # write module entires
-                mod_code = 0
-                for mod_code, module in enumerate(section.modules, start=1):
-                    # write module title
-                    f.write(f'- [{module.title}][s{sec_code}-{mod_code}]\n')
-
-                    # write module files if any
-                    file_code = 1
-                    if len(module.files) > 0:
-                        # module files header
-                        f.write(' ' * 2 + '- DL: ')
-                        for file_code, file in enumerate(module.files, start=1):
-                            name = unquote(os.path.basename(file))
-                            code = f's{sec_code}-{mod_code}-f{file_code}'
-                            if file_code > 1: f.write(', ')
-                            f.write(f'[{name}][{code}]')
-                        # module files footer
-                        f.write('\n')
-
-                    # write module description if any
-                    if module.desc is not None:
-                        f.write(f'  - {module.desc}\n')
-
-                    # write files inside folder
-                    for file_code, file in enumerate(module.folder, start=file_code):
+            # write section summary if any
+            if section.desc is not None:
+                f.write(f'> {section.desc}\n')
+                f.write('\n')
+
+            # write module entires
+            mod_code = 0
+            for mod_code, module in enumerate(section.modules, start=1):
+                # write module title
+                f.write(f'- [{module.title}][s{sec_code}-{mod_code}]\n')
+
+                # write module files if any
+                file_code = 1
+                if len(module.files) > 0:
+                    # module files header
+                    f.write(' ' * 2 + '- DL: ')
+                    for file_code, file in enumerate(module.files, start=1):
                         name = unquote(os.path.basename(file))
                         code = f's{sec_code}-{mod_code}-f{file_code}'
-                        f.write(f'  - [{name}][{code}]\n')
-
-                # write newline if no modules are written
-                if mod_code > 0:
+                        if file_code > 1: f.write(', ')
+                        f.write(f'[{name}][{code}]')
+                    # module files footer
                     f.write('\n')
 
-                # write module and files references
-                for mod_code, module in enumerate(section.modules, start=1):
-                    f.write(f'[s{sec_code}-{mod_code}]: {module.href} "{module.tags}"\n')
-                    for file_code, file in enumerate(module.files + module.folder, start=1):
-                        code = f's{sec_code}-{mod_code}-f{file_code}'
-                        f.write(f'[{code}]: {file} "Direct Link"\n')
+                # write module description if any
+                if module.desc is not None:
+                    f.write(f'  - {module.desc}\n')
 
-                # default padding
+                # write files inside folder
+                for file_code, file in enumerate(module.folder, start=file_code):
+                    name = unquote(os.path.basename(file))
+                    code = f's{sec_code}-{mod_code}-f{file_code}'
+                    f.write(f'  - [{name}][{code}]\n')
+
+            # write newline if no modules are written
+            if mod_code > 0:
                 f.write('\n')
 
+            # write module and files references
+            for mod_code, module in enumerate(section.modules, start=1):
+                f.write(f'[s{sec_code}-{mod_code}]: {module.href} "{module.tags}"\n')
+                for file_code, file in enumerate(module.files + module.folder, start=1):
+                    code = f's{sec_code}-{mod_code}-f{file_code}'
+                    f.write(f'[{code}]: {file} "Direct Link"\n')
 
-def find_lcs(S1, S2):
-    # populate the table
-    m, n = len(S1), len(S2)
-    table = [ [ 0 for x in range(n+1) ] for x in range(m+1) ]
-    for i in range(1, m+1):
-        for j in range(1, n+1):
-            if S1[i-1] == S2[j-1]:
-                table[i][j] = table[i-1][j-1] + 1
-            else:
-                table[i][j] = max(table[i-1][j], table[i][j-1])
-
-    # find the lcs
-    lcs = []
-    index = table[m][n]
-    while m > 0 and n > 0:
-        if S1[m-1] == S2[n-1]:
-            lcs.insert(0, S1[m-1])
-            m -= 1
-            n -= 1
-            index -= 1
-        elif table[m-1][n] > table[m][n-1]:
-            m -= 1
-        else:
-            n -= 1
+            # default padding
+            f.write('\n')
+
+        return f.getvalue()
+
+
+def dump_site(site) -> bytes:
+    return noodle_snapshot.dumps(site.snapshot())
+
+
+class Snapshots:
+    # decoded sites keyed by blob id; a blob shared by many commits is
+    # decoded once, and the least recently used ones are dropped
+    def __init__(self, size=256):
+        self.size = size
+        self.sites = OrderedDict()
+        self.lock = threading.Lock()
 
-    return lcs
+    def get(self, blob) -> Site:
+        with self.lock:
+            site = self.sites.get(blob.id)
+            if site is not None:
+                self.sites.move_to_end(blob.id)
+                return site
+        return self.put(blob.id, load_site(blob.data))
+
+    def put(self, oid, site) -> Site:
+        with self.lock:
+            self.sites[oid] = site
+            self.sites.move_to_end(oid)
+            while len(self.sites) > self.size:
+                self.sites.popitem(last=False)
+        return site
+
+
+snapshots = Snapshots()
+
+
+def load_site(data) -> Site:
+    return build_site(noodle_snapshot.loads(data))
+
+
+def build_site(snapshot) -> Site:
+    sections = []
+    for section in snapshot['sections']:
+        modules = [ Module(**module) for module in section['modules'] ]
+        sections.append(Section(section['title'], section['desc'], modules))
+    return Site(snapshot['title'], snapshot['code'], sections)
+
+
+def parse_module(tree) -> Module:
+    # set resource tree; shift to aalink subtree if it exists
+    res_tree = sel.MODULE_INSTANCE(tree)[0]
+    aalink = sel.MODULE_LINK(res_tree)
+    if aalink: res_tree = aalink[0]
+
+    # set module title
+    text = sel.MODULE_TEXT(res_tree)
+    title = text.pop(0).strip()
+
+    # set description if any
+    desc_tree = sel.MODULE_DESC(tree)
+    desc = sel.DESC_TEXT(desc_tree[0]) if len(desc_tree) > 0 else None
+    desc = ' '.join(desc[0].split()) if desc is not None else None
+
+    # set tags, aka the rest of the text()
+    tags = [ t.strip() for t in text ]
+    if sel.MODULE_DIMMED(res_tree):
+        tags.append("Restricted")
+    tags = ', '.join(tags)
+
+    # set link to page
+    href = sel.MODULE_HREF(res_tree)
+    href = href[0].strip() if len(href) > 0 else '#'
+
+    # download-able files and folder sub files are set by resolve()
+    return Module(title, desc, tags, href)
+
+
+def parse_section(tree) -> Section:
+    # set section title
+    title = sel.SECTION_TITLE(tree)[0].strip()
+
+    # set description if any
+    desc_tree = sel.SECTION_SUMMARY(tree)[0]
+    desc = sel.DESC_TEXT(desc_tree[0]) if len(desc_tree) > 0 else None
+    desc = ' '.join(desc[0].split()) if desc is not None and len(desc) > 0 else None
+
+    # add modules
+    modules = []
+    for mod_tree in sel.SECTION_MODULES(tree):
+        modules.append(parse_module(mod_tree))
+
+    return Section(title, desc, modules)
+
+
+def parse_site(tree) -> Site:
+    header = sel.SITE_HEADER(tree)[0]
+    title = sel.SITE_TITLE(header)[0].split(' ', 1)[1].strip()
+    code = sel.SITE_CODE(header)[0].strip()
+    sections = []
+    for sec_tree in sel.SECTIONS(tree):
+        sections.append(parse_section(sec_tree))
+    return Site(title, code, sections)
+
+
+def parse_links(tree) -> dict:
+    # set download-able files
+    files = []
+    for link in sel.RESOURCE_LINKS(tree):
+        if 'pluginfile.php' in link and 'submission' not in link:
+            files.append(link.split("?")[0])
+
+    # set folder sub files
+    folder = []
+    for link in sel.FOLDER_LINKS(tree):
+        if 'pluginfile.php' in link:
+            folder.append(link.split("?")[0])
+
+    return { 'files': files, 'folder': folder }
+
+
+def middle_snake(a, b, a0, a1, b0, b1):
+    # walk forward from the top left and backward from the bottom right
+    # until the furthest reaching d-paths overlap (Myers, 1986)
+    n, m = a1 - a0, b1 - b0
+    delta = n - m
+    odd = delta % 2 == 1
+    offset = (n + m + 1) // 2 + 1
+    vf = [ 0 ] * (2 * offset + 1)
+    vb = [ 0 ] * (2 * offset + 1)
+
+    for d in range(offset):
+        # forward d-paths
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and vf[offset+k-1] < vf[offset+k+1]):
+                x = vf[offset+k+1]
+            else:
+                x = vf[offset+k-1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[a0+x] == b[b0+y]:
+                x += 1
+                y += 1
+            vf[offset+k] = x
+            if odd and delta - d < k < delta + d and x + vb[offset+delta-k] >= n:
+                return a0 + x0, b0 + y0, a0 + x, b0 + y
+
+        # backward d-paths, on the reversed sequences
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and vb[offset+k-1] < vb[offset+k+1]):
+                x = vb[offset+k+1]
+            else:
+                x = vb[offset+k-1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[a1-1-x] == b[b1-1-y]:
+                x += 1
+                y += 1
+            vb[offset+k] = x
+            if not odd and -d <= delta - k <= d and x + vf[offset+delta-k] >= n:
+                return a1 - x, b1 - y, a1 - x0, b1 - y0
+
+
+def diff_range(a, b, a0, a1, b0, b1, script):
+    # trim common prefix and suffix
+    while a0 < a1 and b0 < b1 and a[a0] == b[b0]:
+        script.append((0, a0, b0))
+        a0 += 1
+        b0 += 1
+    suffix = []
+    while a0 < a1 and b0 < b1 and a[a1-1] == b[b1-1]:
+        a1 -= 1
+        b1 -= 1
+        suffix.append((0, a1, b1))
+
+    # split on the middle snake; each half has at most half the edits
+    if a0 == a1:
+        script.extend((2, a0, j) for j in range(b0, b1))
+    elif b0 == b1:
+        script.extend((1, i, b0) for i in range(a0, a1))
+    else:
+        x, y, u, v = middle_snake(a, b, a0, a1, b0, b1)
+        diff_range(a, b, a0, x, b0, y, script)
+        script.extend((0, x + i, y + i) for i in range(u - x))
+        diff_range(a, b, u, a1, v, b1, script)
+
+    script.extend(reversed(suffix))
+
+
+def diff_seq(S1, S2) -> list:
+    # map items to integer keys so comparisons stay cheap
+    keys = {}
+    a = [ keys.setdefault(x, len(keys)) for x in S1 ]
+    b = [ keys.setdefault(x, len(keys)) for x in S2 ]
+
+    # build edit script; 0 keeps, 1 deletes from S1, 2 inserts from S2
+    script = []
+    diff_range(a, b, 0, len(a), 0, len(b), script)
+    return [ (op, S2[j] if op == 2 else S1[i]) for op, i, j in script ]
+
+
+def diff_hunks(S1, S2) -> list:
+    # group consecutive edits into (deleted, inserted) runs
+    hunks = []
+    dels, adds = [], []
+    for op, item in diff_seq(S1, S2) + [ (0, None) ]:
+        if op == 1:
+            dels.append(item)
+        elif op == 2:
+            adds.append(item)
+        elif dels or adds:
+            hunks.append((dels, adds))
+            dels, adds = [], []
+    return hunks
+
+
+def diff_flags(S1, S2) -> list:
+    # flag removed entries 1 and added entries 2, interleaving each hunk
+    # so that a revised entry sits right after its previous version
+    ret = []
+    for dels, adds in diff_hunks(S1, S2):
+        for i in range(max(len(dels), len(adds))):
+            if i < len(dels):
+                ret.append((1, dels[i]))
+            if i < len(adds):
+                ret.append((2, adds[i]))
+    return ret
 
 
 class DiffSec:
-    def __init__(self, sec_a, sec_b):
-        self.title = sec_b.title
-        self.desc = sec_b.desc
-        self.flag = 0
-        lcs_mods = find_lcs(sec_a.modules, sec_b.modules)
-        modules = []
-        for i in range(max(len(sec_a.modules), len(sec_b.modules))):
-            if i < len(sec_a.modules) and sec_a.modules[i] not in lcs_mods:
-                module = sec_a.modules[i]
-                module.flag = 1
-                modules.append(module)
-            if i < len(sec_b.modules) and sec_b.modules[i] not in lcs_mods:
-                module = sec_b.modules[i]
-                module.flag = 2
-                modules.append(module)
+    def __init__(self, section, flag, modules):
+        self.title = section.title
+        self.desc = section.desc
+        self.flag = flag
         self.modules = modules
 
 
@@ -242,154 +461,175 @@ class Diff:
             self.time_b = time_b.strftime('%b %d %H:%M')
         self.time_a = time_a.strftime('%b %d %H:%M')
 
-        # build longest common subsequence
-        lcs_secs = find_lcs(site.sections, prev.sections)
-
         # generate whole section diffs
-        sections = []
-        for i in range(max(len(site.sections), len(prev.sections))):
-            if i < len(prev.sections) and prev.sections[i] not in lcs_secs:
-                section = prev.sections[i]
-                section.flag = 1
-                sections.append(section)
-            if i < len(site.sections) and site.sections[i] not in lcs_secs:
-                section = site.sections[i]
-                section.flag = 2
-                sections.append(section)
+        flagged = diff_flags(prev.sections, site.sections)
 
         # replace consecutive del/add diffs with precise section diffs
+        sections = []
         i = 0
-        while i < len(sections) - 1:
-            if sections[i].flag == 1 and sections[i+1].flag == 2:
-                if sections[i].title == sections[i+1].title:
-                    section = DiffSec(sections[i], sections[i+1])
-                    sections.pop(i)
-                    sections.pop(i)
-                    sections.insert(i, section)
-            i += 1
+        while i < len(flagged):
+            flag, section = flagged[i]
+            if flag == 1 and i + 1 < len(flagged) and flagged[i+1][0] == 2 \
+                    and flagged[i+1][1].title == section.title:
+                after = flagged[i+1][1]
+                sections.append(DiffSec(after, 0, diff_flags(section.modules, after.modules)))
+                i += 2
+            else:
+                sections.append(DiffSec(section, flag, [ (flag, m) for m in section.modules ]))
+                i += 1
 
         self.sections = sections
 
     def files(self) -> list:
         ret = []
         for section in self.sections:
-            if section.flag != 1:
-                for module in section.modules:
-                    if not hasattr(module, 'flag') or module.flag != 1:
-                        ret += module.files
-                        ret += module.folder
+            for flag, module in section.modules:
+                if flag != 1:
+                    ret += module.files
+                    ret += module.folder
         return ret
 
-    def write_markdown(self, file):
-        if len(self.sections) == 0: return
-        with open(file, 'w') as f:
-            # write site title and code
-            f.write(f'# {self.title}\n')
-            f.write(f'`{self.code}` ')
-            f.write(f'`DIFF: {self.time_a} -> {self.time_b}`\n')
-            f.write('\n')
+    def delta(self) -> str:
+        return f'DIFF: {self.time_a} -> {self.time_b}'
+
+    def write_markdown(self, file) -> bool:
+        if len(self.sections) == 0: return False
+        return write_text(file, self.markdown())
+
+    def markdown(self) -> str:
+        f = io.StringIO()
+
+        # write site title and code
+        f.write(f'# {self.title}\n')
+        f.write(f'`{self.code}` ')
+        f.write(f'`{self.delta()}`\n')
+        f.write('\n')
+
+        # write custom css style
+        f.write('<style>\n')
+        f.write('add { color: green; }\n')
+        f.write('del { color: red; text-decoration: none; }\n')
+        f.write('ul > li > ul > li { font-size: 75%; }\n')
+        f.write('</style>\n')
+        f.write('\n')
+
+        for sec_code, section in enumerate(self.sections, start=1):
+            # color output according to diff flags
+            if section.flag == 1:
+                prefix, suffix = '<del>', '</del>'
+            elif section.flag == 2:
+                prefix, suffix = '<add>', '</add>'
+            else:
+                prefix, suffix = '', ''
 
-            # write custom css style
-            f.write('<style>\n')
-            f.write('add { color: green; }\n')
-            f.write('del { color: red; text-decoration: none; }\n')
-            f.write('ul > li > ul > li { font-size: 75%; }\n')
-            f.write('</style>\n')
-            f.write('\n')
+            # write section title
+            f.write(f'## {prefix}{section.title}{suffix}\n')
 
-            for sec_code, section in enumerate(self.sections, start=1):
+            # write section summary if any
+            if section.desc is not None:
+                f.write(f'> {prefix}{section.desc}{suffix}\n')
+                f.write('\n')
+
+            # write module entires
+            mod_code = 0
+            for mod_code, (flag, module) in enumerate(section.modules, start=1):
                 # color output according to diff flags
-                if section.flag == 1:
+                if flag == 1:
                     prefix, suffix = '<del>', '</del>'
-                elif section.flag == 2:
+                elif flag == 2:
                     prefix, suffix = '<add>', '</add>'
                 else:
                     prefix, suffix = '', ''
 
-                # write section title
-                f.write(f'## {prefix}{section.title}{suffix}\n')
-
-                # write section summary if any
-                if section.desc is not None:
-                    f.write(f'> {prefix}{section.desc}{suffix}\n')
-                    f.write('\n')
+                # write module title
+                f.write(f'- [{prefix}{module.title}{suffix}][s{sec_code}-{mod_code}]\n')
 
-                # write module entires
-                mod_code = 0
-                for mod_code, module in enumerate(section.modules, start=1):
-                    # color output according to diff flags
-                    if section.flag == 1:
-                        prefix, suffix = '<del>', '</del>'
-                    elif section.flag == 2:
-                        prefix, suffix = '<add>', '</add>'
-                    elif module.flag == 1:
-                        prefix, suffix = '<del>', '</del>'
-                    elif module.flag == 2:
-                        prefix, suffix = '<add>', '</add>'
-                    else:
-                        prefix, suffix = '', ''
-
-                    # write module title
-                    f.write(f'- [{prefix}{module.title}{suffix}][s{sec_code}-{mod_code}]\n')
-
-                    # write module files if any
-                    file_code = 1
-                    if len(module.files) > 0:
-                        # module files header
-                        f.write(' ' * 2 + '- DL: ')
-                        for file_code, file in enumerate(module.files, start=1):
-                            name = unquote(os.path.basename(file))
-                            code = f's{sec_code}-{mod_code}-f{file_code}'
-                            if file_code > 1: f.write(', ')
-                            f.write(f'[{prefix}{name}{suffix}][{code}]')
-                        # module files footer
-                        f.write('\n')
-
-                    # write module description if any
-                    if module.desc is not None:
-                        f.write(f'  - {prefix}{module.desc}{suffix}\n')
-
-                    # write files inside folder
-                    for file_code, file in enumerate(module.folder, start=file_code):
+                # write module files if any
+                file_code = 1
+                if len(module.files) > 0:
+                    # module files header
+                    f.write(' ' * 2 + '- DL: ')
+                    for file_code, file in enumerate(module.files, start=1):
                         name = unquote(os.path.basename(file))
                         code = f's{sec_code}-{mod_code}-f{file_code}'
-                        f.write(f'  - [{prefix}{name}{suffix}][{code}]\n')
-
-                # write newline if no modules are written
-                if mod_code > 0:
+                        if file_code > 1: f.write(', ')
+                        f.write(f'[{prefix}{name}{suffix}][{code}]')
+                    # module files footer
                     f.write('\n')
 
-                # write module and files references
-                for mod_code, module in enumerate(section.modules, start=1):
-                    f.write(f'[s{sec_code}-{mod_code}]: {module.href} "{module.tags}"\n')
-                    for file_code, file in enumerate(module.files + module.folder, start=1):
-                        code = f's{sec_code}-{mod_code}-f{file_code}'
-                        f.write(f'[{code}]: {file} "Direct Link"\n')
+                # write module description if any
+                if module.desc is not None:
+                    f.write(f'  - {prefix}{module.desc}{suffix}\n')
 
-                # default padding
+                # write files inside folder
+                for file_code, file in enumerate(module.folder, start=file_code):
+                    name = unquote(os.path.basename(file))
+                    code = f's{sec_code}-{mod_code}-f{file_code}'
+                    f.write(f'  - [{prefix}{name}{suffix}][{code}]\n')
+
+            # write newline if no modules are written
+            if mod_code > 0:
                 f.write('\n')
 
+            # write module and files references
+            for mod_code, (flag, module) in enumerate(section.modules, start=1):
+                f.write(f'[s{sec_code}-{mod_code}]: {module.href} "{module.tags}"\n')
+                for file_code, file in enumerate(module.files + module.folder, start=1):
+                    code = f's{sec_code}-{mod_code}-f{file_code}'
+                    f.write(f'[{code}]: {file} "Direct Link"\n')
+
+            # default padding
+            f.write('\n')
+
+        return f.getvalue()
+
 
-def load_config(key):
+def write_text(file, text) -> bool:
+    # leave byte-identical files alone, so their mtime stays put
+    data = text.encode()
     try:
-        with open('config.json', 'r') as f:
-            config = json.load(f)[key]
+        if os.path.getsize(file) == len(data):
+            with open(file, 'rb') as f:
+                if f.read() == data:
+                    return False
+    except OSError:
+        pass
+    with open(file, 'wb') as f:
+        f.write(data)
+    return True
+
+
+# config path; absolute while replaying into another dir
+CONFIG = 'config.json'
+
+
+def load_config(key, default=None):
+    try:
+        with open(CONFIG, 'r') as f:
+            config = json.load(f)
+        config = config[key] if default is None else config.get(key, default)
     except:
         print("[-] Unable to read config.")
         sys.exit(0)
     return config
 
 
-def login():
-    # initialize new session
-    sess = requests.session()
+# state of a run, set up by the commands; unset while used as a library
+sess = None
+cache = None
+ws = None
+recorder = None
+procs = None
+metrics = Metrics()
+
 
+def authenticate(sess, moodle):
     # get login token from site
     try:
-        login_url = 'https://moodle.uowplatform.edu.au/login/index.php'
+        login_url = moodle + '/login/index.php'
         page = sess.get(login_url)
         tree = html.fromstring(page.content)
-        token = tree.xpath('//input[@name="logintoken"]/@value')[0]
+        token = sel.LOGIN_TOKEN(tree)[0]
     except:
         print("[-] Unable to reach Moodle.")
         sys.exit(0)
@@ -409,185 +649,947 @@ def login():
 
     sess.post(login_url, data=payload)
 
+
+def expired(r) -> bool:
+    # moodle sends requests of a lapsed session to the login page
+    if not r.is_redirect:
+        return False
+    return urlparse(r.headers['Location']).path.endswith('/login/index.php')
+
+
+def login():
+    # moodle instance; a stand-in can be configured for benchmarks
+    moodle = load_config('moodle', 'https://moodle.uowplatform.edu.au')
+
+    # initialize new session; pooled for the configured concurrency
+    sess = noodle_http.session(
+        load_config('workers', 4),
+        load_config('rate', 10),
+        load_config('timeout', 30)
+    )
+    sess.hooks['response'].append(metrics.response)
+
+    # reuse the cookies of the last run; only sign in again once moodle
+    # turns a request away, which may happen mid-run as well
+    noodle_http.load_cookies(sess, 'session.json')
+    lock = threading.Lock()
+    local = threading.local()
+
+    def resend(r):
+        # copy of a request with the current session cookies
+        req = r.request.copy()
+        req.headers.pop('Cookie', None)
+        req.prepare_cookies(sess.cookies)
+        return req
+
+    def relogin(r, *args, **kwargs):
+        if getattr(local, 'busy', False) or not expired(r):
+            return None
+        r.close()
+
+        local.busy = True
+        try:
+            with lock:
+                # another worker may have signed in again meanwhile
+                if resend(r).headers.get('Cookie') == r.request.headers.get('Cookie'):
+                    authenticate(sess, moodle)
+                    noodle_http.save_cookies(sess, 'session.json')
+
+            # send the request again with the new session cookies
+            retry = sess.send(resend(r), **kwargs)
+        finally:
+            local.busy = False
+
+        if expired(retry) or urlparse(retry.url).path.endswith('/login/index.php'):
+            raise requests.HTTPError('unable to sign in again', response=retry)
+        return retry
+
+    sess.hooks['response'].append(relogin)
+
     # check login status by extracting username
     try:
-        page = sess.get('https://moodle.uowplatform.edu.au/my/')
+        page = sess.get(moodle + '/my/')
         tree = html.fromstring(page.content)
-        user = tree.xpath('//span[@class="usertext mr-1"]/text()')[0].title()
+        user = sel.USER_NAME(tree)[0].title()
     except:
         print("[-] Unable to login.")
         sys.exit(0)
 
+    noodle_http.save_cookies(sess, 'session.json')
     return sess, user
 
 
-# cd to the dir the script is located
-abspath = os.path.abspath(sys.argv[0])
-os.chdir(os.path.dirname(abspath))
-
-print("=" * 48)
-print("[*] Noodle: Automated web scraper for Moodle.")
-print("[*] Started on:", datetime.now().strftime('%c'))
-print("=" * 48)
-
-# create login session
-print("[*] Authenticating with Moodle.")
-global sess, user
-sess, user = login()
-print(f"[+] Greetings, {user}! <3")
-
-# import site entries to fetch
-conf = load_config('sites')
-if not conf:
-    print("[-] Nothing in site entries!")
-    print("[*] Configure sites to fetch in config.json.")
-    sys.exit(0)
-else:
-    print("[*] Fetching course sites.")
-
-# fetch and parse sites
-sites = []
-total = len(conf)
-
-for index, site in enumerate(conf, start=1):
-    # print progress
-    status = f"[*] {index}/{total}: {site['name']}"
-    print(status + ' ' * 4, end='\r')
-
-    # parse site as html tree
-    page = sess.get(site['href'])
-    tree = html.fromstring(page.content)
-    sites.append(Site(tree))
-
-print(f"[+] {total} sites fetched." + ' ' * 12)
-
-# initialize git repo
-if not os.path.exists('json/.git'):
-    pygit2.init_repository('json', False)
-repo = pygit2.Repository('json/.git')
-
-# create working tree
-try:
-    head = repo.head
-    prev = repo.get(head.target)
-    tree = repo.TreeBuilder(prev.tree)
-except:
-    head = None
-    prev = None
-    tree = repo.TreeBuilder()
-
-# write site data to working tree
-for site in sites:
-    # set site filename and contents
-    name = site.code + '.json'
-    data = jsonpickle.encode(site, indent=4)
-
-    # create blob and write to tree
-    blob = repo.create_blob(data)
-    tree.insert(name, blob, pygit2.GIT_FILEMODE_BLOB)
-
-# write tree and compare; create commit only if there are changes
-tree_id = tree.write()
-if prev is not None:
-    tree_diff = repo.get(tree_id).diff_to_tree(prev.tree, 1)
-else:
-    empty = repo.get(repo.TreeBuilder().write())
-    tree_diff = repo.get(tree_id).diff_to_tree(empty, 1)
-
-if tree_diff and 'no_commit' not in sys.argv[1:]:
-    # noodle default signature
-    signature = pygit2.Signature('noodle', 'noodle@localhost')
-    # create commit
-    commit_id = repo.create_commit(
-        head.name if head is not None else 'refs/heads/master',
-        signature, signature,
-        '',
-        tree_id,
-        [ head.target ] if head is not None else []
-    )
-
-# print git status
-status = tree_diff.stats.format(2, 1)
-print('[*] Git:' + status, end='')
-
-# create markdown dir
-if not os.path.exists('markdown'):
-    os.mkdir('markdown')
-
-# reserved for download function
-dl_targets = []
-
-# write site and diff markdowns
-for site in sites:
-    # write site data markdown
-    file = os.path.join('markdown', site.code + '.md')
-    site.write_markdown(file)
-
-    # load the previous site, skip if none exists
-    name = site.code + '.json'
-    if prev is not None and name in prev.tree:
-        # generate diff
-        prev_site = jsonpickle.loads(prev.tree[name].data.decode())
-        time_a = datetime.fromtimestamp(prev.commit_time).astimezone()
-        time_b = datetime.now().astimezone()
-        diff = Diff(site, prev_site, time_a, time_b)
-
-        # write diff markdown
-        file = os.path.join('markdown', site.code + '.diff.md')
-        diff.write_markdown(file)
-
-        # determine if there are materials to fetch
-        if diff.files():
-            dl_targets.append(diff)
-    else:
-        # since this is a new site, download all that exists
-        dl_targets.append(site)
+def fingerprint(tree) -> str:
+    # hash the header and course content only; session keys and generated
+    # element ids differ on every request
+    digest = sha1()
+    for node in sel.FINGERPRINT(tree):
+        digest.update(sel.VOLATILE.sub(b'', html.tostring(node)))
+    return digest.hexdigest()
+
+
+def parse_course(content, known) -> tuple:
+    # fingerprint and snapshot of a course page; none if the page still
+    # matches the known fingerprint
+    tree = sel.parse_page(content)
+    fp = fingerprint(tree)
+    if known == fp:
+        return fp, None
+    return fp, parse_site(tree).snapshot()
+
+
+def parse_page_links(content) -> dict:
+    return parse_links(sel.parse_page(content))
+
+
+def render_site(snapshot, prev, time_a, time_b) -> tuple:
+    # blob data, markdown, diff markdown and delta, and files to download
+    # of a resolved site; prev is the data of its last commit, if any
+    site = build_site(snapshot)
+    data = dump_site(site)
+    markdown = site.markdown()
+    if prev is None:
+        return data, markdown, None, None, site.files()
+    diff = Diff(site, load_site(prev), time_a, time_b)
+    if len(diff.sections) == 0:
+        return data, markdown, None, None, diff.files()
+    return data, markdown, diff.markdown(), diff.delta(), diff.files()
+
+
+def offload(func, *args):
+    # run on the process pool if there is one; workers take and return
+    # bytes and plain snapshots, never lxml trees or site objects
+    if procs is None:
+        return func(*args)
+    return procs.submit(func, *args).result()
+
+
+def get_page(url):
+    # through the page cache, recording the page if this run is archived
+    page = cache.get(sess, url)
+    if recorder is not None:
+        recorder.record(url, page.content)
+    return page
+
+
+def fetch_site(entry, known):
+    global ws
+    with metrics.site(entry['name'], 'sites'):
+        # the whole course in one web service call, files included; fall
+        # back to the pages for the rest of the run if moodle refuses
+        client = ws
+        if client is not None:
+            try:
+                fp, snapshot, links = client.site(entry['href'])
+                if known is not None and known['fingerprint'] == fp:
+                    # files are part of the fingerprint here
+                    return fp, None, None
+                return fp, build_site(snapshot), links
+            except noodle_ws.Unavailable as e:
+                if ws is client:
+                    ws = None
+                    print(f"[-] Web services unavailable ({e}), reading pages instead.")
+            except noodle_ws.Error as e:
+                # only this course is turned down; read its pages
+                print(f"[-] {entry['name']}: {e}, reading its pages instead.")
+
+        # parse site; skip building it if the course page is unchanged,
+        # leaving it to the pipeline whether to revalidate its module pages
+        page = get_page(entry['href'])
+        metrics.cache('pages', page.cached)
+        fp, snapshot = offload(parse_course, page.content, known['fingerprint'] if known is not None else None)
+        if snapshot is None:
+            return fp, None, {}
+        return fp, build_site(snapshot), {}
+
+
+def fetch_page(href, code):
+    with metrics.site(code, 'pages'):
+        # reuse extracted links if the sub-page is unchanged
+        page = get_page(href)
+        metrics.cache('pages', page.cached)
+        if 'links' in page.meta:
+            return page.meta['links']
+
+        # parse module sub-page
+        page.meta['links'] = offload(parse_page_links, page.content)
+        return page.meta['links']
+
+
+# course page fingerprints, kept next to the repo they describe
+FINGERPRINTS = os.path.join('json', '.git', 'fingerprints.json')
+
+
+def load_fingerprints() -> dict:
+    try:
+        with open(FINGERPRINTS, 'r') as f:
+            return json.load(f)
+    except:
+        return {}
+
+
+def save_fingerprints(fingerprints):
+    with open(FINGERPRINTS, 'w') as f:
+        json.dump(fingerprints, f, indent=4)
+
+
+def open_repo():
+    # initialize git repo
+    if not os.path.exists('json/.git'):
+        pygit2.init_repository('json', False)
+    return pygit2.Repository('json/.git')
+
+
+def changed_sites(diff) -> set:
+    # codes of the sites whose committed data was modified
+    return {
+        delta.new_file.path[:-len('.json')] for delta in diff.deltas
+        if delta.status == pygit2.GIT_DELTA_MODIFIED and delta.new_file.path.endswith('.json')
+    }
+
+
+def changes(repo, limit=1000) -> dict:
+    # commit times at which each site changed, oldest first
+    times = {}
+    if repo.head_is_unborn:
+        return times
+    for index, commit in enumerate(repo.walk(repo.head.target, pygit2.GIT_SORT_TIME)):
+        if index == limit:
+            break
+        if not commit.parents:
+            continue
+        for code in changed_sites(repo.diff(commit.parents[0].tree, commit.tree)):
+            times.setdefault(code, []).insert(0, commit.commit_time)
+    return times
+
+
+def interval(times, now, low, high) -> float:
+    # poll about four times per typical gap between changes, and back
+    # off while a site stays quiet for longer than that
+    if not times:
+        return high
+    recent = times[-9:]
+    gaps = sorted(b - a for a, b in zip(recent, recent[1:]))
+    gap = gaps[len(gaps) // 2] if gaps else high
+    gap = max(gap, now - times[-1])
+    return min(high, max(low, gap / 4))
+
+
+class Origin:
+    # stands in for a commit before the first one: an empty tree at the
+    # time asked for, so every site since is diffed as new
+    def __init__(self, repo, when):
+        self.tree = repo.get(repo.TreeBuilder().write())
+        self.commit_time = int(when)
+
+
+def find_commit(repo, spec):
+    # a commit id or ref, a date like 2024-03-01, or days back like 7d;
+    # dates pick the last commit made by then, or the origin before all
+    days = re.fullmatch(r'(\d+)d', spec)
+    if days is None:
+        try:
+            return repo.revparse_single(spec).peel(pygit2.Commit)
+        except (KeyError, ValueError, pygit2.GitError):
+            pass
+    try:
+        when = time.time() - int(days[1]) * 86400 if days else datetime.fromisoformat(spec).timestamp()
+    except ValueError:
+        return None
+    if repo.head_is_unborn:
+        return None
+    for commit in repo.walk(repo.head.target, pygit2.GIT_SORT_TIME):
+        if commit.commit_time <= when:
+            return commit
+    return Origin(repo, when)
+
+
+def diff_commits(repo, a, b, codes=None) -> list:
+    # diffs of the sites that changed from commit a to b, by code; a site
+    # in only one of them is diffed against an empty one; codes match in
+    # any case, as with --site elsewhere
+    codes = { code.upper() for code in codes } if codes else None
+    time_a = datetime.fromtimestamp(a.commit_time).astimezone()
+    time_b = datetime.fromtimestamp(b.commit_time).astimezone()
+    diffs = []
+    for name in sorted({ entry.name for entry in a.tree } | { entry.name for entry in b.tree }):
+        if not name.endswith('.json') or (codes and name[:-len('.json')].upper() not in codes):
+            continue
+        old = a.tree[name] if name in a.tree else None
+        new = b.tree[name] if name in b.tree else None
+        if old is not None and new is not None and old.id == new.id:
+            continue
+
+        prev = snapshots.get(old) if old is not None else None
+        site = snapshots.get(new) if new is not None else None
+        if prev is None:
+            prev = Site(site.title, site.code, [])
+        if site is None:
+            site = Site(prev.title, prev.code, [])
+        diff = Diff(site, prev, time_a, time_b)
+        if diff.sections:
+            diffs.append(diff)
+    return diffs
+
+
+def read_delta(code):
+    # diff time range of fingerprints saved before deltas were recorded
+    try:
+        with open(os.path.join('markdown', code + '.diff.md'), 'r') as f:
+            f.readline()
+            return f.readline().split('`')[3]
+    except:
+        return None
 
-print("[*] Generating markdown index.")
 
-with open(os.path.join('markdown', 'index.md'), 'w') as f:
+def write_index(conf, fingerprints):
+    # index of all sites with the time range of their last diff
+    f = io.StringIO()
     f.write('# Noodle\n\n')
     f.write('<style>\nul > li > ul > li { font-size: 80%; }\n</style>\n\n')
     f.write('## All sites\n\n')
-    for site in sites:
-        f.write(f"- [{site.title}]({site.code + '.md'})\n")
-        try:
-            with open(os.path.join('markdown', site.code + '.diff.md'), 'r') as diff:
-                diff.readline()
-                diff_delta = diff.readline().split('`')[3]
-                f.write(f"  - [`{diff_delta}`]({site.code + '.diff.md'})\n")
-        except:
+    for site in conf:
+        entry = fingerprints.get(site['href'])
+        if entry is None:
+            continue
+        if 'delta' not in entry:
+            entry['delta'] = read_delta(entry['code'])
+        f.write(f"- [{entry['title']}]({entry['code'] + '.md'})\n")
+        if entry['delta'] is not None:
+            f.write(f"  - [`{entry['delta']}`]({entry['code'] + '.diff.md'})\n")
+        else:
             f.write(f"  - `DIFF: None`\n")
+    write_text(os.path.join('markdown', 'index.md'), f.getvalue())
 
-if not dl_targets:
-    print("[*] Course materials are up-to-date.")
-else:
-    print("[*] Fetching new course materials.")
 
-for diff in dl_targets:
-    # download new files
-    files = diff.files()
-    total = len(files)
+def fetch_files(dl_targets):
+    if not dl_targets:
+        print("[*] Course materials are up-to-date.")
+    else:
+        print("[*] Fetching new course materials.")
+
+    # content-addressed store shared by all download dirs
+    store = noodle_download.Store('download')
+    scheduler = noodle_download.Scheduler(
+        sess, store,
+        load_config('workers', 4),
+        load_config('host_connections', 4),
+        load_config('bandwidth', 0) * 2**10,
+        lambda code: metrics.site(code)
+    )
 
-    for index, link in enumerate(files, start=1):
-        # set file name and download location
-        name = unquote(os.path.basename(link))
-        dl_dir = os.path.join('download', diff.code)
+    # one job per file and download location
+    jobs = []
+    for code, files in dl_targets:
+        dl_dir = os.path.join('download', code)
+        if not os.path.exists(dl_dir):
+            os.makedirs(dl_dir)
+        for link in dict.fromkeys(files):
+            jobs.append((code, link, os.path.join(dl_dir, unquote(os.path.basename(link)))))
+
+    # download across all sites at once
+    counts = { code: [ 0, 0, 0 ] for code, files in dl_targets }
+    received = 0
+    # sizes listed by web services spare asking the server
+    hints = ws.sizes if ws is not None else {}
+    for index, ((code, link, file), size, fetched) in enumerate(scheduler.run(jobs, hints), start=1):
+        if fetched is not None:
+            metrics.cache('download', not fetched)
+        counts[code][{ True: 0, False: 1, None: 2 }[fetched]] += 1
+        received += size or 0
+
+        # print aggregate progress
+        status = f"[*] Downloads: {index}/{len(jobs)} files, {received / 2**20:.1f} MB"
+        print(status + ' ' * 4, end='\r')
+
+        # record what was fetched so far
+        if index % 100 == 0:
+            store.save()
+    store.save()
 
+    for code, (fetched, unchanged, failed) in counts.items():
         # print status
-        status = f"[*] {diff.code}: {index}/{total}"
-        print(status + ' ' * 4, end='\r')
+        status = f"[+] {code}: {fetched} files fetched"
+        if unchanged > 0:
+            status += f", {unchanged} unchanged"
+        if failed > 0:
+            status = '[-]' + status[3:] + f", {failed} failed"
+        print(status + '.' + ' ' * 24)
+
+
+def render_history(conf, hrefs):
+    # markdown of the committed sites and of their last change, from the
+    # history alone; picks up changes to rendering without fetching
+    repo = open_repo()
+    if repo.head_is_unborn:
+        print("[-] Nothing committed yet; fetch the sites first.")
+        sys.exit(0)
+    head = repo.get(repo.head.target)
+    fingerprints = load_fingerprints()
+    names = {
+        fingerprints[site['href']]['code'] + '.json': site['href'] for site in conf
+        if site['href'] in hrefs and site['href'] in fingerprints
+    }
+    names = { name: href for name, href in names.items() if name in head.tree }
+
+    # walk back to the commit each site last changed in
+    last = {}
+    commit = head
+    while commit.parents and len(last) < len(names):
+        parent = commit.parents[0]
+        for delta in repo.diff(parent.tree, commit.tree).deltas:
+            name = delta.new_file.path
+            if name in names and name not in last:
+                last[name] = (parent, commit)
+        commit = parent
+
+    if not os.path.exists('markdown'):
+        os.mkdir('markdown')
+    for name, href in names.items():
+        site = snapshots.get(head.tree[name])
+        site.write_markdown(os.path.join('markdown', site.code + '.md'))
+        print(f"[+] {site.code}: rendered.")
+
+        # a site new in its last change has no diff
+        if name not in last or name not in last[name][0].tree:
+            continue
+        parent, commit = last[name]
+        time_a = datetime.fromtimestamp(parent.commit_time).astimezone()
+        time_b = datetime.fromtimestamp(commit.commit_time).astimezone()
+        diff = Diff(snapshots.get(commit.tree[name]), snapshots.get(parent.tree[name]), time_a, time_b)
+        if diff.write_markdown(os.path.join('markdown', site.code + '.diff.md')) or diff.sections:
+            fingerprints[href]['delta'] = diff.delta()
+
+    write_index(conf, fingerprints)
+    save_fingerprints(fingerprints)
+
+
+def write_diffs(repo, since, until, codes=None, output=None):
+    # markdown of what changed between two commits or dates
+    a, b = find_commit(repo, since), find_commit(repo, until)
+    if a is None or b is None:
+        print(f"[-] No commit at or before {since if a is None else until}.")
+        sys.exit(0)
+    for diff in diff_commits(repo, a, b, codes):
+        if output is not None:
+            os.makedirs(output, exist_ok=True)
+            write_text(os.path.join(output, diff.code + '.diff.md'), diff.markdown())
+        else:
+            sys.stdout.write(diff.markdown())
+
+
+def list_sites(conf):
+    # configured sites with the time range of their last diff, offline
+    fingerprints = load_fingerprints()
+    for site in conf:
+        entry = fingerprints.get(site['href'])
+        if entry is None:
+            print(f"{site['name']:<12} (not fetched yet)")
+            continue
+        delta = entry.get('delta') or read_delta(entry['code']) or 'DIFF: None'
+        print(f"{entry['code']:<12} {entry['title']}  `{delta}`")
+
+
+def chosen(conf, codes) -> set:
+    # hrefs of the sites picked with --site, all by default
+    if not codes:
+        return { site['href'] for site in conf }
+    codes = { code.upper() for code in codes }
+    hrefs = { site['href'] for site in conf if site['name'].upper() in codes }
+    if not hrefs:
+        print(f"[-] No configured site matches {', '.join(sorted(codes))}.")
+        sys.exit(0)
+    return hrefs
 
-        # create download dir
-        if not os.path.exists(dl_dir):
-            os.makedirs(dl_dir)
-        
-        # download
-        file = os.path.join(dl_dir, name)
-        r = sess.get(link)
-        with open(file, "wb") as f:
-            f.write(r.content)
-
-    # print status
-    status = f"[+] {diff.code}: {total} files fetched."
-    print(status + ' ' * 4)
+
+def session(conf):
+    # sign in, and open the page cache and web services for a run
+    global sess, cache, ws
+    metrics.enter('login')
+    print("[*] Authenticating with Moodle.")
+    sess, user = login()
+    print(f"[+] Greetings, {user}! <3")
+
+    # read courses through web services when a token is configured
+    token = load_config('token', '')
+    ws = noodle_ws.Client(sess, load_config('moodle', 'https://moodle.uowplatform.edu.au'), token) if token else None
+
+    # open response cache; size limit is in megabytes
+    cache = Cache('cache', load_config('cache_size', 256) * 2**20)
+
+
+def run(args):
+    global metrics
+    if args.command in ('list', 'render'):
+        conf = load_config('sites')
+        if args.command == 'list':
+            list_sites(conf)
+        else:
+            render_history(conf, chosen(conf, args.site))
+        return
+    if args.command == 'diff':
+        write_diffs(open_repo(), args.since, args.until, args.site, args.output)
+        return
+
+    print("=" * 48)
+    print("[*] Noodle: Automated web scraper for Moodle.")
+    print("[*] Started on:", datetime.now().strftime('%c'))
+    print("=" * 48)
+
+    # record per-phase metrics of this run
+    metrics = Metrics()
+
+    # rebuild the history from recorded runs, offline
+    if args.command == 'replay':
+        replay(args.archives, args.refresh)
+        return
+
+    # import site entries to fetch
+    conf = load_config('sites')
+    if not conf:
+        print("[-] Nothing in site entries!")
+        print("[*] Configure sites to fetch in config.json.")
+        sys.exit(0)
+    hrefs = chosen(conf, args.site)
+
+    session(conf)
+    if args.command == 'download':
+        # every file of the committed sites; unchanged ones are not sent again
+        repo = open_repo()
+        fingerprints = load_fingerprints()
+        head = repo.get(repo.head.target) if not repo.head_is_unborn else None
+        dl_targets = []
+        for site in conf:
+            entry = fingerprints.get(site['href'])
+            if site['href'] in hrefs and entry is not None and head is not None and entry['code'] + '.json' in head.tree:
+                dl_targets.append((entry['code'], snapshots.get(head.tree[entry['code'] + '.json']).files()))
+        metrics.enter('download')
+        fetch_files(dl_targets)
+        metrics.enter(None)
+        metrics.write('metrics')
+        return
+
+    print("[*] Fetching course sites.")
+    if args.command == 'watch':
+        watch(conf, hrefs, args.refresh, args.record)
+    else:
+        update(conf, None if args.site is None else hrefs, args.refresh,
+            commit=not args.no_commit, record=args.record, download=not args.no_download)
+
+
+# bare switch of earlier versions, which cron lines may still pass
+LEGACY = { 'no_commit': '--no-commit' }
+
+
+def arguments(argv, commands) -> list:
+    # fetch unless a command is given
+    argv = [ LEGACY.get(arg, arg) for arg in argv ]
+    options = [ arg for arg in argv if arg == '--profile' ]
+    argv = [ arg for arg in argv if arg != '--profile' ]
+    if not argv or argv[0] not in commands and argv[0] not in ('-h', '--help'):
+        argv = [ 'fetch' ] + argv
+    return options + argv
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Automated web scraper for Moodle.')
+    parser.add_argument('--profile', action='store_true', help='run under cprofile and tracemalloc, into metrics/')
+    sub = parser.add_subparsers(dest='command')
+
+    def command(name, helptext, sites=True):
+        cmd = sub.add_parser(name, help=helptext)
+        if sites:
+            cmd.add_argument('-s', '--site', action='append', help='only this site code; may be repeated')
+        return cmd
+
+    cmd = command('fetch', 'fetch, commit and render the sites, then download new files (default)')
+    cmd.add_argument('--refresh', action='store_true', help='rebuild sites whose course page is unchanged too')
+    cmd.add_argument('--no-commit', action='store_true', help='render without committing')
+    cmd.add_argument('--no-download', action='store_true', help='skip downloading files')
+    cmd.add_argument('--record', action='store_true', help='archive every page of the run for replays')
+    cmd = command('watch', 'keep running and poll each site on its own schedule')
+    cmd.add_argument('--refresh', action='store_true', help='rebuild every site on the first poll')
+    cmd.add_argument('--record', action='store_true', help='archive every page of each poll for replays')
+    command('download', 'download the files of the committed sites')
+    command('render', 'render markdown from the committed sites, offline')
+    cmd = command('diff', 'show what changed between two commits or dates, offline')
+    cmd.add_argument('since', nargs='?', default='HEAD~1', help='commit, date like 2024-03-01, or days back like 7d')
+    cmd.add_argument('until', nargs='?', default='HEAD', help='commit or date, HEAD by default')
+    cmd.add_argument('-o', '--output', help='write <code>.diff.md files to this dir instead of printing')
+    command('list', 'list the configured sites, offline', sites=False)
+    cmd = command('replay', 'rebuild the history from recorded runs into replay/, offline', sites=False)
+    cmd.add_argument('archives', nargs='*', help='archives to replay, all in archive/ by default')
+    cmd.add_argument('--refresh', action='store_true', help='rebuild sites whose course page is unchanged too')
+    args = parser.parse_args(arguments(sys.argv[1:] if argv is None else argv, sub.choices))
+
+    # paths given are relative to where noodle was started
+    if getattr(args, 'output', None) is not None:
+        args.output = os.path.abspath(args.output)
+    if args.command == 'replay':
+        args.archives = [ os.path.abspath(path) for path in args.archives ]
+
+    # cd to the dir the script is located
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    if args.profile:
+        profile(lambda: run(args), 'metrics')
+    else:
+        run(args)
+
+
+def replay(paths, refresh=False):
+    # feed recorded runs, oldest first, through parsing, commits and
+    # rendering again; the history is rebuilt in replay/ with the times
+    # of the recorded runs, leaving json/ and markdown/ alone
+    global sess, cache, ws, CONFIG
+    archives = sorted((noodle_archive.Archive(path) for path in paths or glob.glob(os.path.abspath('archive/*.zip'))), key=lambda a: a.time)
+    if not archives:
+        print("[-] No recorded runs in archive/.")
+        print("[*] Run noodle.py fetch --record to archive its runs.")
+        sys.exit(0)
+
+    CONFIG = os.path.abspath(CONFIG)
+    os.makedirs('replay', exist_ok=True)
+    os.chdir('replay')
+
+    # no session; pages and web service calls come from the archives
+    sess = None
+    cache = noodle_archive.Replay()
+    for archive in archives:
+        print("=" * 48)
+        print("[*] Replaying run of:", datetime.fromtimestamp(archive.time).strftime('%c'))
+        cache.push(archive)
+        ws = noodle_ws.Client(None, '', '', cache) if cache.calls() else None
+        metrics.reset()
+        update(archive.sites, refresh=refresh, stamp=archive.time)
+
+
+def watch(conf, hrefs, refresh=False, record=False):
+    # keep the session, cache and snapshots warm, and poll each site on
+    # its own schedule; sites that changed often lately are polled sooner
+    low = load_config('watch_min', 300)
+    high = load_config('watch_max', 6 * 3600)
+    history = changes(open_repo())
+    schedule = { site['href']: 0 for site in conf if site['href'] in hrefs }
+
+    # room for the last and the new snapshot of every site
+    snapshots.size = max(snapshots.size, 2 * len(conf))
+
+    try:
+        while True:
+            # poll the sites due shortly together; a site not committed
+            # yet is retried on every poll
+            now = time.time()
+            fingerprints = load_fingerprints()
+            due = { href for href, at in schedule.items() if at <= now + min(60, low) or href not in fingerprints }
+            if due:
+                print("=" * 48)
+                print(f"[*] Polling {len(due)} sites on:", datetime.now().strftime('%c'))
+                metrics.reset()
+                cache.forget()
+                try:
+                    changed = update(conf, due, refresh, warm=True, record=record)
+                    refresh = False
+                except requests.RequestException:
+                    print("[-] Unable to reach Moodle, retrying later.")
+                    changed = set()
+
+                # reschedule the polled sites by their change history
+                now = time.time()
+                for code in changed:
+                    history.setdefault(code, []).append(now)
+                codes = { href: entry['code'] for href, entry in load_fingerprints().items() }
+                for href in due:
+                    schedule[href] = now + interval(history.get(codes.get(href)), now, low, high)
+
+            time.sleep(max(1, min(schedule.values()) - time.time()))
+    except KeyboardInterrupt:
+        print("[*] Stopped watching.")
+
+
+def update(conf, due=None, refresh=False, warm=False, stamp=None, commit=True, record=False, download=True) -> set:
+    global recorder, procs
+    repo = open_repo()
+
+    # time of the run; replays keep the time they were recorded at
+    stamp = time.time() if stamp is None else stamp
+    now = datetime.fromtimestamp(stamp).astimezone()
+
+    # archive every page of this run for replays
+    if sess is not None and record:
+        recorder = noodle_archive.Recorder('archive', conf)
+        if ws is not None:
+            ws.archive = recorder
+
+    # create working tree
+    try:
+        head = repo.head
+        prev = repo.get(head.target)
+        tree = repo.TreeBuilder(prev.tree)
+    except:
+        head = None
+        prev = None
+        tree = repo.TreeBuilder()
+    time_a = datetime.fromtimestamp(prev.commit_time).astimezone() if prev is not None else None
+
+    # fingerprints of the course pages behind the last commit; a site
+    # whose page still matches reuses its tree entry and markdown
+    known = {}
+    fingerprints = load_fingerprints()
+    for site in conf:
+        entry = fingerprints.get(site['href'])
+        if entry is None or refresh:
+            continue
+        if prev is not None and entry['code'] + '.json' in prev.tree:
+            known[site['href']] = entry
+
+    # skipped runs after which the module pages of an unchanged site are
+    # read again; never by default
+    revalidate = load_config('revalidate', 0)
+
+    # sites not due for a poll, or not chosen, are taken as unchanged
+    todo = [ site for site in conf if due is None or site['href'] in due ]
+
+    # create markdown dir
+    if not os.path.exists('markdown'):
+        os.mkdir('markdown')
+
+    def render(entry, site, fp, rendered=None):
+        # write one site to the tree and render it; from here on only
+        # its title, code, fingerprint and files are kept
+        href = entry['href']
+        fingerprints[href] = { 'fingerprint': fp, 'code': site.code, 'title': site.title }
+
+        # an empty diff leaves the last diff markdown in place
+        if 'delta' in last.get(href, {}):
+            fingerprints[href]['delta'] = last[href]['delta']
+
+        name = site.code + '.json'
+        if rendered is not None:
+            # rendered by a worker process; only write the results
+            data, markdown, diff_markdown, delta, files = rendered
+            with metrics.site(site.code, 'commit'):
+                blob = repo.create_blob(data)
+                tree.insert(name, blob, pygit2.GIT_FILEMODE_BLOB)
+
+            with metrics.site(site.code, 'markdown'):
+                write_text(os.path.join('markdown', site.code + '.md'), markdown)
+                if diff_markdown is not None:
+                    write_text(os.path.join('markdown', site.code + '.diff.md'), diff_markdown)
+                    fingerprints[href]['delta'] = delta
+        else:
+            with metrics.site(site.code, 'commit'):
+                # create blob and write to tree
+                blob = repo.create_blob(dump_site(site))
+                tree.insert(name, blob, pygit2.GIT_FILEMODE_BLOB)
+
+            with metrics.site(site.code, 'markdown'):
+                # write site data markdown
+                site.write_markdown(os.path.join('markdown', site.code + '.md'))
+
+            # load the previous site, skip if none exists
+            files = site.files()
+            if prev is not None and name in prev.tree:
+                with metrics.site(site.code, 'diff'):
+                    # generate diff
+                    if warm:
+                        prev_site = snapshots.get(prev.tree[name])
+                    else:
+                        prev_site = load_site(prev.tree[name].data)
+                    diff = Diff(site, prev_site, time_a, now)
+                    files = diff.files()
+
+                with metrics.site(site.code, 'markdown'):
+                    # write diff markdown
+                    diff.write_markdown(os.path.join('markdown', site.code + '.diff.md'))
+                    if diff.sections:
+                        fingerprints[href]['delta'] = diff.delta()
+
+        # queue materials to fetch; a new site downloads all that exists
+        if files:
+            dl_targets.append((site.code, files))
+
+        # keep the site as the snapshot of the next diff while watching
+        if warm:
+            snapshots.put(blob, site)
+
+    # stream each site through fetch, parse, sub-page fetches, blob insert,
+    # diff and render; at most `window` sites are in flight at a time
+    metrics.enter('pipeline')
+    workers = load_config('workers', 4)
+    window = 2 * workers
+    queue = iter(todo)
+    total = len(todo)
+    last = dict(fingerprints)
+    dl_targets = []
+    flight = {}
+    futures = {}
+    done = 0
+    updated = 0
+    pages = 0
+
+    # parse and render on worker processes as well, if configured; the
+    # workers are started fresh rather than forked from the threads
+    processes = load_config('processes', 0)
+    if processes > 0:
+        procs = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'))
+    rendering = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            # admit sites into the window
+            while len(flight) < window:
+                entry = next(queue, None)
+                if entry is None:
+                    break
+                flight[entry['href']] = None
+                futures[pool.submit(fetch_site, entry, known.get(entry['href']))] = (entry, None)
+            if not futures and not rendering:
+                break
+
+            finished, _ = wait([ *futures, *rendering ], return_when=FIRST_COMPLETED)
+            for future in finished:
+                if future in rendering:
+                    # rendered on the process pool; write it out
+                    entry, site, fp = rendering.pop(future)
+                    render(entry, site, fp, future.result())
+                else:
+                    entry, href = futures.pop(future)
+                    if href is None:
+                        # course page; keep the last commit if it failed
+                        try:
+                            fp, site, links = future.result()
+                        except requests.RequestException:
+                            print(f"[-] Unable to fetch {entry['name']}." + ' ' * 12)
+                            fp, site, links = None, None, None
+
+                        # course page unchanged; files may still be added or
+                        # replaced behind it, so every `revalidate` skips the
+                        # module pages of the committed site are read again
+                        kept = None
+                        if site is None and links is not None:
+                            last_fp = known[entry['href']]
+                            last_fp['skipped'] = last_fp.get('skipped', 0) + 1
+                            if revalidate > 0 and last_fp['skipped'] >= revalidate:
+                                name = last_fp['code'] + '.json'
+                                kept = site = snapshots.get(prev.tree[name]) if warm else load_site(prev.tree[name].data)
+                        if site is None:
+                            del flight[entry['href']]
+                            done += 1
+                            continue
+
+                        # fetch the module sub-pages not listed with the site
+                        hrefs = { m.href for m in site.modules() if m.pending() and m.href not in links }
+                        state = flight[entry['href']] = { 'site': site, 'fingerprint': fp, 'links': links, 'kept': kept, 'waiting': len(hrefs) }
+                        for page in hrefs:
+                            futures[pool.submit(fetch_page, page, site.code)] = (entry, page)
+                        pages += len(hrefs)
+                    else:
+                        state = flight[entry['href']]
+                        try:
+                            state['links'][href] = future.result()
+                        except requests.RequestException:
+                            state['links'][href] = None
+                        state['waiting'] -= 1
+
+                    if state['waiting'] > 0:
+                        continue
+
+                    # all sub-pages are in; a site missing any keeps its last commit
+                    if None in state['links'].values():
+                        del flight[entry['href']]
+                        done += 1
+                        print(f"[-] Unable to fetch module pages of {state['site'].code}." + ' ' * 12)
+                        continue
+                    site, fp = state['site'].resolve(state['links']), state['fingerprint']
+
+                    # nothing changed behind an unchanged course page either
+                    if site == state['kept']:
+                        known[entry['href']]['skipped'] = 0
+                        del flight[entry['href']]
+                        done += 1
+                        continue
+
+                    # render on the process pool; the site stays in flight
+                    # until it is written
+                    if procs is not None:
+                        name = site.code + '.json'
+                        data = prev.tree[name].data if prev is not None and name in prev.tree else None
+                        rendering[procs.submit(render_site, site.snapshot(), data, time_a, now)] = (entry, site, fp)
+                        continue
+                    render(entry, site, fp)
+
+                del flight[entry['href']]
+                done += 1
+                updated += 1
+
+                # print progress
+                status = f"[*] {done}/{total}: {site.code}"
+                print(status + ' ' * 4, end='\r')
+
+    if procs is not None:
+        procs.shutdown()
+        procs = None
+
+    status = f"[+] {total} sites fetched"
+    if updated < total:
+        status += f", {total - updated} unchanged"
+    print(status + '.' + ' ' * 12)
+    print(f"[+] {pages} module pages resolved." + ' ' * 12)
+    cache.save()
+    if recorder is not None:
+        recorder.close()
+        recorder = None
+        if ws is not None:
+            ws.archive = None
+
+    # write tree and compare; create commit only if there are changes
+    metrics.enter('commit')
+    tree_id = tree.write()
+    if prev is not None:
+        tree_diff = repo.get(tree_id).diff_to_tree(prev.tree, 1)
+    else:
+        empty = repo.get(repo.TreeBuilder().write())
+        tree_diff = repo.get(tree_id).diff_to_tree(empty, 1)
+
+    if tree_diff and commit:
+        # noodle default signature
+        signature = pygit2.Signature('noodle', 'noodle@localhost', int(stamp), int(now.utcoffset().total_seconds()) // 60)
+        # create commit
+        commit_id = repo.create_commit(
+            head.name if head is not None else 'refs/heads/master',
+            signature, signature,
+            '',
+            tree_id,
+            [ head.target ] if head is not None else []
+        )
+
+    # keep the history index in step with the repo
+    noodle_history.update(repo)
+
+    # print git status
+    status = tree_diff.stats.format(2, 1)
+    print('[*] Git:' + status, end='')
+
+    metrics.enter('index')
+    print("[*] Generating markdown index.")
+    write_index(conf, fingerprints)
+
+    # record fingerprints once the tree they describe is committed
+    if not tree_diff or commit:
+        save_fingerprints(fingerprints)
+
+    # replays have no session to download with
+    metrics.enter('download')
+    if sess is not None and download:
+        fetch_files(dl_targets)
+
+    # machine-readable run report
+    metrics.enter(None)
+    metrics.write('metrics')
+
+    return changed_sites(tree_diff)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import json
+import os, os.path
+import threading
+import time
+from hashlib import sha1
+
+import noodle_selectors as sel
+
+
+class Page:
+    def __init__(self, content, digest, meta, cached):
+        self.content = content
+        self.hash = digest
+        self.meta = meta
+        self.cached = cached
+
+
+class Cache:
+    def __init__(self, path, limit):
+        self.path = path
+        self.limit = limit
+        self.lock = threading.Lock()
+
+        # urls validated in this run; repeated ones never leave the
+        # process, and their bodies are read back from disk rather than
+        # kept in memory
+        self.memory = set()
+
+        # load validators and content hashes of previous runs
+        try:
+            with open(os.path.join(path, 'index.json'), 'r') as f:
+                self.index = json.load(f)
+        except:
+            self.index = {}
+
+    def forget(self):
+        # drop the memory layer, so the next poll revalidates every page
+        with self.lock:
+            self.memory.clear()
+
+    def body(self, url) -> str:
+        return os.path.join(self.path, sha1(url.encode()).hexdigest())
+
+    def get(self, sess, url) -> Page:
+        with self.lock:
+            entry = self.index.get(url)
+            fresh = url in self.memory
+
+        # revalidate with the stored validators if the body is still there
+        headers = {}
+        body = None
+        if entry is not None:
+            try:
+                with open(self.body(url), 'rb') as f:
+                    body = f.read()
+            except OSError:
+                entry = None
+        if entry is not None and fresh:
+            return Page(body, entry['hash'], entry['meta'], True)
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('modified'):
+                headers['If-Modified-Since'] = entry['modified']
+
+        r = sess.get(url, headers=headers)
+
+        if r.status_code == 304 and entry is not None:
+            page = Page(body, entry['hash'], entry['meta'], True)
+        elif r.status_code == 200:
+            digest = sel.page_digest(r.content)
+            if entry is not None and entry['hash'] == digest:
+                # same page without validators; keep derived data
+                page = Page(r.content, digest, entry['meta'], True)
+            else:
+                page = Page(r.content, digest, {}, False)
+                tmp = self.body(url) + '.tmp'
+                os.makedirs(self.path, exist_ok=True)
+                with open(tmp, 'wb') as f:
+                    f.write(r.content)
+                os.replace(tmp, self.body(url))
+            entry = {
+                'etag': r.headers.get('ETag'),
+                'modified': r.headers.get('Last-Modified'),
+                'hash': digest,
+                'size': len(r.content),
+                'meta': page.meta
+            }
+        else:
+            # never cache errors or redirects to the login page
+            return Page(r.content, sel.page_digest(r.content), {}, False)
+
+        with self.lock:
+            entry['used'] = time.time()
+            self.index[url] = entry
+            self.memory.add(url)
+        return page
+
+    def save(self):
+        with self.lock:
+            # evict least recently used bodies beyond the size limit
+            size = 0
+            for url in sorted(self.index, key=lambda u: self.index[u]['used'], reverse=True):
+                size += self.index[url]['size']
+                if size > self.limit:
+                    del self.index[url]
+                    try:
+                        os.remove(self.body(url))
+                    except OSError:
+                        pass
+
+            os.makedirs(self.path, exist_ok=True)
+            tmp = os.path.join(self.path, 'index.json.tmp')
+            with open(tmp, 'w') as f:
+                json.dump(self.index, f)
+            os.replace(tmp, os.path.join(self.path, 'index.json'))
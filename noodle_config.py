@@ -1,102 +1,231 @@
 #!/usr/bin/env python3
 
+import argparse
+import json
 import os, os.path
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from getpass import getpass
-from base64 import b64encode
+from base64 import b64decode, b64encode
 
-import requests
 import jsonpickle
+import requests
 from lxml import html
 
-# cd to the dir the script is located
-abspath = os.path.abspath(sys.argv[0])
-os.chdir(os.path.dirname(abspath))
-
-print("============================")
-print("[*] Noodle: Automated setup.")
-print("============================")
-
-# initialize new session
-sess = requests.session()
-
-# get login token from site
-try:
-    login_url = 'https://moodle.uowplatform.edu.au/login/index.php'
-    page = sess.get(login_url)
-    tree = html.fromstring(page.content)
-    token = tree.xpath('//input[@name="logintoken"]/@value')[0]
-except:
-    print("[-] Unable to reach Moodle.")
-    sys.exit(0)
-
-print()
-print("[*] This will require your login credentials.")
-key = [ input('Username: '), getpass() ]
-print()
-
-# authenticate with payload; and
-# halt if no proper credentials provided
-try:
-    payload = {
-        'logintoken': token,
-        'username': key[0],
-        'password': key[1]
-    }
-except:
-    print("[-] Invaild credentials.")
-    sys.exit(0)
-
-print("[*] Authenticating with Moodle.")
-sess.post(login_url, data=payload)
-
-# check login status by extracting username
-try:
-    page = sess.get('https://moodle.uowplatform.edu.au/my/')
-    tree = html.fromstring(page.content)
-    user = tree.xpath('//span[@class="usertext mr-1"]/text()')[0].title()
-except:
-    print("[-] Unable to login.")
-    sys.exit(0)
-
-print(f"[+] Hey there, {user}!")
-print()
-print("[*] Noodle will now analyze the sites. Hang tight!")
-
-sites = []
-for course_tree in tree.xpath('//div[@id="courses"]//div[contains(@id, "course-")]'):
-    # ignore non subject sites
-    if course_tree.xpath('.//small/text()')[0] != 'Subject':
-        continue
-
-    # extract site link
-    href = str(course_tree.xpath('.//strong/a/@href')[0])
-
-    # form html tree from site
-    site_page = sess.get(href)
-    site_tree = html.fromstring(site_page.content)
+import noodle_http
+import noodle_selectors as sel
+import noodle_ws
+
+# end of the course page header, which holds the site title and code
+HEADER_END = b'</header>'
+
+
+def read_config() -> dict:
+    # config of an earlier setup to merge into; none on a fresh setup
+    try:
+        with open('config.json', 'r') as f:
+            return json.load(f)
+    except:
+        print("[-] Unable to read config, setting up a new one.")
+        return None
+
+
+def credentials(conf) -> list:
+    # reuse the login of the config being merged into
+    try:
+        return b64decode(conf['login']).decode().split(':', 1)
+    except:
+        pass
+    print()
+    print("[*] This will require your login credentials.")
+    key = [ input('Username: '), getpass() ]
+    print()
+    return key
+
+
+def authenticate(sess, moodle, key) -> tuple:
+    # get login token from site
+    try:
+        login_url = moodle + '/login/index.php'
+        page = sess.get(login_url)
+        tree = html.fromstring(page.content)
+        token = sel.LOGIN_TOKEN(tree)[0]
+    except:
+        print("[-] Unable to reach Moodle.")
+        sys.exit(0)
+
+    # authenticate with payload; and
+    # halt if no proper credentials provided
+    try:
+        payload = {
+            'logintoken': token,
+            'username': key[0],
+            'password': key[1]
+        }
+    except:
+        print("[-] Invaild credentials.")
+        sys.exit(0)
+
+    print("[*] Authenticating with Moodle.")
+    sess.post(login_url, data=payload)
+
+    # check login status by extracting username
+    try:
+        page = sess.get(moodle + '/my/')
+        tree = html.fromstring(page.content)
+        user = sel.USER_NAME(tree)[0].title()
+    except:
+        print("[-] Unable to login.")
+        sys.exit(0)
+    return tree, user
+
+
+def course_header(sess, href) -> tuple:
+    # stream the course page only up to the end of its course header; the
+    # sections below it are most of the page. other headers, e.g. of a
+    # navbar, may come before it
+    content = b''
+    header = None
+    start = 0
+    with sess.get(href, stream=True) as r:
+        r.raise_for_status()
+        for chunk in r.iter_content(16384):
+            content += chunk
+            while header is None:
+                end = content.find(HEADER_END, start)
+                if end < 0:
+                    break
+                start = end + len(HEADER_END)
+                header = next(iter(sel.SITE_HEADER(sel.parse_page(content[:start]))), None)
+            if header is not None:
+                break
+
+    # the whole page if the header could not be told apart on the way
+    if header is None:
+        header = sel.SITE_HEADER(sel.parse_page(content))[0]
 
     # extract site title and code
-    header = site_tree.xpath('./body/div/div/div/header')[0]
-    title = header.xpath('.//h1/text()')[0].split(' ', 1)[1].strip()
-    code = header.xpath('.//a[@aria-current="page"]/text()')[0].strip()
-
-    # append site
-    print(f'[+] Found: {title}')
-    site = {
-        'name': code,
-        'href': href
-    }
-    sites.append(site)
-
-print()
-print("[*] Generating config.")
-
-conf = {
-    'login': b64encode(f'{key.pop(0)}:{key.pop(0)}'.encode('ascii')).decode("ascii"),
-    'sites': sites
-}
-with open('config.json', 'w') as f:
-    f.write(jsonpickle.encode(conf, indent=4))
-
-print('[*] Done!')
+    title = sel.SITE_TITLE(header)[0].split(' ', 1)[1].strip()
+    code = sel.SITE_CODE(header)[0].strip()
+    return title, code
+
+
+def read_header(sess, href):
+    # title and code of a course, or none if its page cannot be read
+    try:
+        return course_header(sess, href)
+    except (requests.RequestException, IndexError):
+        return None
+
+
+def subjects(tree, known) -> list:
+    # subject sites on the dashboard that are not configured yet
+    hrefs = []
+    for course_tree in sel.COURSES(tree):
+        # ignore non subject sites
+        if sel.COURSE_TYPE(course_tree)[0] != 'Subject':
+            continue
+
+        # extract site link
+        href = str(sel.COURSE_LINK(course_tree)[0])
+        if href not in known:
+            hrefs.append(href)
+    return hrefs
+
+
+def discover_ws(ws, hrefs) -> list:
+    # titles and codes of the enrolled courses come in one call
+    courses = ws.enrolled()
+    sites = []
+    for href in hrefs:
+        course = courses.get(noodle_ws.course_id(href))
+        if course is None:
+            print(f'[-] Not listed by web services: {href}')
+            continue
+        title = course['fullname'].split(' ', 1)[1].strip()
+        print(f'[+] Found: {title}')
+        sites.append({ 'name': course['shortname'].strip(), 'href': href })
+    return sites
+
+
+def discover_pages(sess, hrefs, workers) -> list:
+    # read the headers concurrently, keeping the dashboard order
+    sites = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for href, header in zip(hrefs, pool.map(lambda href: read_header(sess, href), hrefs)):
+            if header is None:
+                print(f'[-] Unable to read {href}, skipping it.')
+                continue
+            title, code = header
+            print(f'[+] Found: {title}')
+            sites.append({ 'name': code, 'href': href })
+    return sites
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Set up config.json for noodle.')
+    parser.add_argument('--merge', action='store_true',
+        help='add newly enrolled sites to the existing config.json, keeping its entries and settings')
+    args = parser.parse_args()
+
+    # cd to the dir the script is located
+    abspath = os.path.abspath(sys.argv[0])
+    os.chdir(os.path.dirname(abspath))
+
+    print("============================")
+    print("[*] Noodle: Automated setup.")
+    print("============================")
+
+    # merge into the existing config, if asked to and there is one
+    conf = (read_config() if args.merge else None) or {}
+    known = { site['href'] for site in conf.get('sites', []) }
+
+    # initialize new session; pooled for the configured concurrency
+    moodle = conf.get('moodle', 'https://moodle.uowplatform.edu.au')
+    workers = conf.get('workers', 4)
+    sess = noodle_http.session(workers, conf.get('rate', 10), conf.get('timeout', 30))
+
+    key = credentials(conf)
+    tree, user = authenticate(sess, moodle, key)
+
+    # keep the session for the first run of noodle
+    noodle_http.save_cookies(sess, 'session.json')
+
+    print(f"[+] Hey there, {user}!")
+    print()
+    print("[*] Noodle will now analyze the sites. Hang tight!")
+
+    # read the subject sites of the dashboard through web services where
+    # moodle allows, reusing the configured token if it is still accepted
+    hrefs = subjects(tree, known)
+    ws = None
+    for token in ([ conf['token'] ] if conf.get('token') else []) + [ None ]:
+        try:
+            ws = noodle_ws.Client(sess, moodle, token or noodle_ws.token(sess, moodle, key[0], key[1]))
+            sites = discover_ws(ws, hrefs)
+            break
+        except noodle_ws.Error:
+            ws = None
+    if ws is None:
+        print("[*] Web services unavailable, reading course pages instead.")
+        sites = discover_pages(sess, hrefs, workers)
+
+    print()
+    if known:
+        print(f"[*] Adding {len(sites)} new sites to the {len(known)} configured.")
+    else:
+        print("[*] Generating config.")
+
+    # configured sites keep their place and any edits; new ones go last
+    conf['login'] = b64encode(f'{key.pop(0)}:{key.pop(0)}'.encode('ascii')).decode("ascii")
+    conf['sites'] = conf.get('sites', []) + sites
+    if ws is not None:
+        conf['token'] = ws.token
+    with open('config.json', 'w') as f:
+        f.write(jsonpickle.encode(conf, indent=4))
+
+    print('[*] Done!')
+
+
+if __name__ == '__main__':
+    main()
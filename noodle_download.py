@@ -0,0 +1,303 @@
+import heapq
+import json
+import os, os.path
+import queue
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from hashlib import sha1, sha256
+from urllib.parse import urlparse
+
+import requests
+
+from noodle_http import TokenBucket
+
+
+def validator(headers):
+    # what identifies this version of a file for if-range; weak etags
+    # may not be used there
+    etag = headers.get('ETag')
+    if etag is not None and not etag.startswith('W/'):
+        return etag
+    return headers.get('Last-Modified')
+
+
+def download(sess, link, file, etag=None, chunk_size=2**16, throttle=None):
+    # partial transfers are kept next to the target until complete, with
+    # the validator of the response they came from
+    part = file + '.part'
+    tag = part + '.tag'
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    resume = None
+    if offset > 0:
+        try:
+            with open(tag, 'r') as f:
+                resume = f.read()
+        except OSError:
+            # no telling which version the bytes are from
+            os.remove(part)
+            offset = 0
+
+    # ask for raw bytes so content-length matches what lands on disk; a
+    # partial file is only resumed while the server still has its version
+    headers = { 'Accept-Encoding': 'identity' }
+    if resume:
+        headers['Range'] = f'bytes={offset}-'
+        headers['If-Range'] = resume
+    elif etag is not None:
+        headers['If-None-Match'] = etag
+
+    with sess.get(link, headers=headers, stream=True) as r:
+        if r.status_code == 304:
+            return None
+        if r.status_code == 416:
+            # stale partial file; start over on the next attempt
+            os.remove(part)
+            raise IOError(f'range not satisfiable: {link}')
+        r.raise_for_status()
+
+        # resume only if the server honoured the range; the size of the
+        # complete file is the total of the range, if the server reports it
+        content_range = r.headers.get('Content-Range', '')
+        if r.status_code == 206 and not content_range.startswith(f'bytes {offset}-'):
+            os.remove(part)
+            raise IOError(f'unexpected range {content_range!r}: {link}')
+        if r.status_code == 206:
+            mode = 'ab'
+            total = content_range.rpartition('/')[2]
+            expected = int(total) if total.isdigit() else None
+        else:
+            offset, mode = 0, 'wb'
+            length = r.headers.get('Content-Length')
+            expected = int(length) if length is not None else None
+
+            # a new transfer; remember which version the bytes belong to
+            if validator(r.headers) is not None:
+                with open(tag, 'w') as f:
+                    f.write(validator(r.headers))
+            elif os.path.exists(tag):
+                os.remove(tag)
+
+        with open(part, mode) as f:
+            for chunk in r.iter_content(chunk_size):
+                f.write(chunk)
+                if throttle is not None:
+                    throttle(len(chunk))
+
+    # keep the partial file for resuming if the transfer fell short
+    size = os.path.getsize(part)
+    if expected is not None and size != expected:
+        raise IOError(f'incomplete transfer ({size}/{expected} bytes): {link}')
+
+    os.replace(part, file)
+    if os.path.exists(tag):
+        os.remove(tag)
+    return r.headers
+
+
+def file_hash(file, chunk_size=2**16) -> str:
+    digest = sha256()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Store:
+    def __init__(self, path):
+        # blobs are named by content hash; targets are hard links to them
+        self.path = path
+        self.blobs = os.path.join(path, '.store')
+        self.tmp = os.path.join(self.blobs, 'tmp')
+        os.makedirs(self.tmp, exist_ok=True)
+        self.lock = threading.Lock()
+
+        # last known size, etag and hash of every fetched url
+        try:
+            with open(os.path.join(path, '.manifest.json'), 'r') as f:
+                self.manifest = json.load(f)
+        except:
+            self.manifest = {}
+
+    def blob(self, digest) -> str:
+        return os.path.join(self.blobs, digest)
+
+    def fetch(self, sess, link, file, throttle=None) -> bool:
+        # only trust manifest entries whose blob is still around
+        entry = self.manifest.get(link)
+        if entry is not None and not os.path.exists(self.blob(entry['hash'])):
+            entry = None
+
+        # without an etag, compare what a head request reports
+        if entry is not None and entry['etag'] is None and self.unchanged(sess, link, entry):
+            self.place(entry['hash'], file)
+            return False
+
+        # stream into a per-url temp file so retries can resume
+        tmp = os.path.join(self.tmp, sha1(link.encode()).hexdigest())
+        headers = download(sess, link, tmp, entry['etag'] if entry is not None else None, throttle=throttle)
+        if headers is None:
+            self.place(entry['hash'], file)
+            return False
+
+        # move into the store unless identical bytes are already there
+        digest = file_hash(tmp)
+        if os.path.exists(self.blob(digest)):
+            os.remove(tmp)
+        else:
+            os.replace(tmp, self.blob(digest))
+        self.place(digest, file)
+
+        entry = {
+            'size': os.path.getsize(self.blob(digest)),
+            'etag': headers.get('ETag'),
+            'modified': headers.get('Last-Modified'),
+            'hash': digest
+        }
+        with self.lock:
+            self.manifest[link] = entry
+        return True
+
+    def unchanged(self, sess, link, entry) -> bool:
+        if entry['modified'] is None:
+            return False
+        r = sess.head(link, headers={ 'Accept-Encoding': 'identity' }, allow_redirects=True)
+        if r.status_code != 200:
+            return False
+        return r.headers.get('Last-Modified') == entry['modified'] and \
+            r.headers.get('Content-Length') == str(entry['size'])
+
+    def place(self, digest, file):
+        blob = self.blob(digest)
+        if os.path.exists(file):
+            if os.path.samefile(blob, file):
+                return
+            os.remove(file)
+
+        # hard link into place; fall back to a copy across filesystems
+        try:
+            os.link(blob, file)
+        except FileExistsError:
+            # the same name from another link in this run; last one wins
+            os.remove(file)
+            os.link(blob, file)
+        except OSError:
+            shutil.copyfile(blob, file)
+
+    def save(self):
+        tmp = os.path.join(self.path, '.manifest.json.tmp')
+        with self.lock:
+            manifest = dict(self.manifest)
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(self.path, '.manifest.json'))
+
+
+class Scheduler:
+    def __init__(self, sess, store, workers=4, per_host=4, bandwidth=0, track=None):
+        # bandwidth is a cap in bytes per second shared by all transfers
+        self.sess = sess
+        self.store = store
+        self.workers = workers
+        self.per_host = per_host
+        self.bucket = TokenBucket(bandwidth, max(bandwidth, 2**16))
+        self.track = track or (lambda code: nullcontext())
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def host(self, link) -> threading.Semaphore:
+        netloc = urlparse(link).netloc
+        with self.lock:
+            if netloc not in self.hosts:
+                self.hosts[netloc] = threading.BoundedSemaphore(self.per_host)
+            return self.hosts[netloc]
+
+    def known(self, link, hints):
+        # from an earlier transfer, else as moodle listed it
+        with self.store.lock:
+            entry = self.store.manifest.get(link)
+        if entry is not None:
+            return entry['size']
+        return hints.get(link)
+
+    def size(self, code, link):
+        # as the server reports it
+        with self.track(code), self.host(link):
+            try:
+                r = self.sess.head(link, headers={ 'Accept-Encoding': 'identity' }, allow_redirects=True)
+                return int(r.headers['Content-Length']) if r.status_code == 200 else None
+            except (requests.RequestException, KeyError, ValueError):
+                return None
+
+    def fetch(self, code, link, file):
+        # true if transferred, false if unchanged and none if it failed;
+        # retries resume from the partial file
+        with self.track(code), self.host(link):
+            for attempt in range(3):
+                try:
+                    return self.store.fetch(self.sess, link, file, self.bucket.take)
+                except (requests.RequestException, OSError):
+                    pass
+        return None
+
+    def run(self, jobs, hints=None):
+        # jobs are (code, link, file) and hints sizes by link; yields each
+        # job with its size and result as it completes, smallest known
+        # files first. transfers start right away; files of unknown size
+        # are sized with head requests meanwhile, from the back of the
+        # list, and those not started by then join the known ones
+        hints = hints or {}
+        sizes = [ self.known(link, hints) for code, link, file in jobs ]
+        ready = [ (size, i) for i, size in enumerate(sizes) if size is not None ]
+        heapq.heapify(ready)
+        unsized = { i: None for i, size in enumerate(sizes) if size is None }
+        lock = threading.Lock()
+        results = queue.Queue()
+
+        def take():
+            with lock:
+                if ready:
+                    return heapq.heappop(ready)[1]
+                if unsized:
+                    i = next(iter(unsized))
+                    del unsized[i]
+                    return i
+                return None
+
+        def measure():
+            while True:
+                with lock:
+                    if not unsized:
+                        return
+                    i = next(reversed(unsized))
+                size = self.size(*jobs[i][:2])
+                with lock:
+                    if i in unsized:
+                        del unsized[i]
+                        sizes[i] = size
+                        heapq.heappush(ready, (size if size is not None else float('inf'), i))
+
+        def transfer():
+            try:
+                while True:
+                    i = take()
+                    if i is None:
+                        return
+                    results.put((i, self.fetch(*jobs[i])))
+            except BaseException as e:
+                results.put((None, e))
+
+        with ThreadPoolExecutor(max_workers=self.workers + 1) as pool:
+            pool.submit(measure)
+            for worker in range(self.workers):
+                pool.submit(transfer)
+            for done in range(len(jobs)):
+                i, result = results.get()
+                if i is None:
+                    raise result
+
+                # size of what was transferred if not known before
+                if sizes[i] is None:
+                    sizes[i] = self.known(jobs[i][1], {})
+                yield jobs[i], sizes[i], result
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+import argparse
+import os, os.path
+import sqlite3
+import sys
+from datetime import datetime
+
+import pygit2
+
+import noodle_snapshot
+
+# every site, section, module and file ever committed, with the commit it
+# first appeared in and the commit it was gone in (null while present);
+# commits are numbered along the first-parent history
+SCHEMA = '''
+create table if not exists commits (id integer primary key, oid text unique not null, time integer not null);
+create table if not exists sites (code text, title text, first integer, gone integer, primary key (code));
+create table if not exists sections (code text, title text, first integer, gone integer, primary key (code, title));
+create table if not exists modules (code text, href text, title text, section text, tags text,
+    first integer, gone integer, primary key (code, href, title));
+create table if not exists files (code text, url text, module text, first integer, gone integer, primary key (code, url));
+create table if not exists state (key text primary key, value text);
+'''
+
+TABLES = ('sites', 'sections', 'modules', 'files')
+KEYS = { 'sites': ('code',), 'sections': ('code', 'title'), 'modules': ('code', 'href', 'title'), 'files': ('code', 'url') }
+
+
+def connect(path) -> sqlite3.Connection:
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    return db
+
+
+def items(code, snapshot) -> dict:
+    # rows of one site snapshot per table, keyed by primary key
+    ret = { 'sites': {}, 'sections': {}, 'modules': {}, 'files': {} }
+    ret['sites'][(code,)] = { 'title': snapshot['title'] }
+    for section in snapshot['sections']:
+        ret['sections'][(code, section['title'])] = {}
+        for module in section['modules']:
+            ret['modules'][(code, module['href'], module['title'])] = { 'section': section['title'], 'tags': module['tags'] }
+            for url in module['files'] + module['folder']:
+                ret['files'][(code, url)] = { 'module': module['href'] }
+    return ret
+
+
+def apply(db, code, snapshot, commit):
+    # bring the rows of one site in line with its snapshot at a commit;
+    # a removed site has no snapshot
+    rows = items(code, snapshot) if snapshot is not None else { table: {} for table in TABLES }
+    for table in TABLES:
+        keys = KEYS[table]
+        where = ' and '.join(f'{k} = ?' for k in keys)
+        present = { row[:-1] for row in db.execute(
+            f'select {", ".join(keys)}, gone from {table} where code = ? and gone is null', (code,)) }
+
+        # rows gone from the site
+        for key in present - rows[table].keys():
+            db.execute(f'update {table} set gone = ? where {where}', (commit, *key))
+
+        # rows new to the site, or back after being gone
+        for key, values in rows[table].items():
+            columns = (*keys, *values, 'first', 'gone')
+            db.execute(
+                f'insert into {table} ({", ".join(columns)}) values ({", ".join("?" * len(columns))}) '
+                f'on conflict ({", ".join(keys)}) do update set gone = null' + ''.join(f', {k} = excluded.{k}' for k in values),
+                (*key, *values.values(), commit, None)
+            )
+
+
+def update(repo, path=None) -> int:
+    # index commits made since the last update; returns how many
+    path = path or os.path.join(repo.path, 'history.db')
+    if repo.head_is_unborn:
+        return 0
+    db = connect(path)
+
+    # first-parent commits after the last indexed one, oldest first
+    row = db.execute('select value from state where key = ?', ('head',)).fetchone()
+    indexed = row[0] if row is not None else None
+    commits = []
+    commit = repo.get(repo.head.target)
+    while commit is not None and str(commit.id) != indexed:
+        commits.append(commit)
+        commit = commit.parents[0] if commit.parents else None
+
+    # history no longer contains the indexed head; start over
+    if commit is None and indexed is not None:
+        db.close()
+        os.remove(path)
+        return update(repo, path)
+
+    with db:
+        for commit in reversed(commits):
+            cid = db.execute('insert into commits (oid, time) values (?, ?)', (str(commit.id), commit.commit_time)).lastrowid
+            if commit.parents:
+                deltas = repo.diff(commit.parents[0].tree, commit.tree).deltas
+                paths = [ delta.new_file.path for delta in deltas ]
+            else:
+                paths = [ entry.name for entry in commit.tree ]
+
+            for name in paths:
+                if not name.endswith('.json'):
+                    continue
+                snapshot = noodle_snapshot.loads(commit.tree[name].data) if name in commit.tree else None
+                apply(db, name[:-len('.json')], snapshot, cid)
+
+        if commits:
+            db.execute('insert or replace into state (key, value) values (?, ?)', ('head', str(commits[0].id)))
+
+    db.close()
+    return len(commits)
+
+
+def seen(db, table, where, args) -> list:
+    # rows with the time of the commit they first appeared in, and of the
+    # last commit they were still present in (null while present)
+    return db.execute(
+        f'select {table}.*, a.time, b.time from {table} '
+        f'join commits a on a.id = {table}.first '
+        f'left join commits b on b.id = {table}.gone - 1 '
+        f'where {where} order by {table}.first', args
+    ).fetchall()
+
+
+def sites(db) -> list:
+    return seen(db, 'sites', '1', ())
+
+
+def modules(db, code=None, query=None) -> list:
+    return seen(db, 'modules', '(? is null or code = ?) and (? is null or title like ?)',
+        (code, code, query, f'%{query}%'))
+
+
+def files(db, code=None, query=None) -> list:
+    return seen(db, 'files', '(? is null or code = ?) and (? is null or url like ?)',
+        (code, code, query, f'%{query}%'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the history of the sites noodle has committed.')
+    parser.add_argument('--db', help='index file, json/.git/history.db by default')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('sites', help='list every site')
+    for name in ('modules', 'files'):
+        cmd = sub.add_parser(name, help=f'list every {name[:-1]} ever published')
+        cmd.add_argument('code', nargs='?', help='site code, e.g. CSCI235')
+        cmd.add_argument('-q', '--query', help='match titles or urls containing this text')
+    cmd = sub.add_parser('diff', help='show what changed between two commits or dates')
+    cmd.add_argument('since', help='commit, date like 2024-03-01, or days back like 7d')
+    cmd.add_argument('until', nargs='?', default='HEAD', help='commit or date, HEAD by default')
+    cmd.add_argument('-s', '--site', action='append', help='only this site code; may be repeated')
+    cmd.add_argument('-o', '--output', help='write <code>.diff.md files to this dir instead of printing')
+    args = parser.parse_args()
+
+    # cd to the dir the script is located, and catch up with the repo
+    if args.db is not None:
+        args.db = os.path.abspath(args.db)
+    if getattr(args, 'output', None) is not None:
+        args.output = os.path.abspath(args.output)
+    os.chdir(os.path.dirname(os.path.abspath(sys.argv[0])))
+    if not os.path.exists('json/.git'):
+        print("[-] No history yet; run noodle.py first.")
+        sys.exit(0)
+    repo = pygit2.Repository('json/.git')
+    update(repo, args.db)
+
+    if args.command == 'diff':
+        # noodle pulls in lxml; load it for diffs only
+        from noodle import write_diffs
+        write_diffs(repo, args.since, args.until, args.site, args.output)
+        return
+
+    def when(t):
+        return datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M') if t is not None else 'present'
+
+    db = connect(args.db or os.path.join(repo.path, 'history.db'))
+    if args.command == 'sites':
+        for code, title, first, gone, a, b in sites(db):
+            print(f'{when(a)} .. {when(b)}  {code}  {title}')
+    elif args.command == 'modules':
+        for code, href, title, section, tags, first, gone, a, b in modules(db, args.code, args.query):
+            print(f'{when(a)} .. {when(b)}  {code}  {section} / {title} ({tags})')
+    else:
+        for code, url, module, first, gone, a, b in files(db, args.code, args.query):
+            print(f'{when(a)} .. {when(b)}  {code}  {url}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        # rate is in tokens, e.g. requests or bytes, per second; a rate of
+        # 0 never waits
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, count=1):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+
+            # hold the lock while waiting, so takers are served in order
+            if self.tokens < count:
+                time.sleep((count - self.tokens) / self.rate)
+                self.tokens = count
+                self.stamp = time.monotonic()
+            self.tokens -= count
+
+
+class JitterRetry(Retry):
+    # full jitter; parallel workers do not retry in lockstep
+    def get_backoff_time(self) -> float:
+        return random.uniform(0, super().get_backoff_time())
+
+
+class Transport(HTTPAdapter):
+    def __init__(self, workers, bucket, timeout, retries):
+        self.bucket = bucket
+        self.timeout = timeout
+        super().__init__(pool_connections=4, pool_maxsize=workers, max_retries=retries)
+
+    def send(self, request, **kwargs):
+        # every request goes through the rate limiter and has a timeout
+        self.bucket.take()
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def session(workers=4, rate=10, timeout=30, retries=4) -> requests.Session:
+    # retry idempotent requests on throttling and server errors,
+    # honouring retry-after; login posts are never repeated
+    retry = JitterRetry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        respect_retry_after_header=True
+    )
+    transport = Transport(workers, TokenBucket(rate, max(1, workers)), timeout, retry)
+
+    sess = requests.session()
+    sess.headers['Accept-Encoding'] = 'gzip, deflate'
+    sess.mount('http://', transport)
+    sess.mount('https://', transport)
+    return sess
+
+
+def load_cookies(sess, path) -> bool:
+    try:
+        with open(path, 'r') as f:
+            cookies = json.load(f)
+    except:
+        return False
+    for c in cookies:
+        sess.cookies.set(c['name'], c['value'], domain=c['domain'], path=c['path'],
+            secure=c['secure'], expires=c['expires'])
+    return True
+
+
+def save_cookies(sess, path):
+    # a session cookie is as good as the password; owner only
+    cookies = [
+        { 'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path,
+            'secure': c.secure, 'expires': c.expires }
+        for c in sess.cookies
+    ]
+    tmp = path + '.tmp'
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        os.fchmod(f.fileno(), 0o600)
+        json.dump(cookies, f, indent=4)
+    os.replace(tmp, path)
@@ -0,0 +1,162 @@
+import json
+import os, os.path
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+
+        # phases run one after another; sites are per worker thread
+        self.current = None
+        self.entered = None
+        self.local = threading.local()
+
+        self.phases = {}
+        self.sites = {}
+        self.http = {}
+        self.caches = {}
+
+    def enter(self, name):
+        # close the running phase and start the next one, if any
+        now = time.perf_counter()
+        with self.lock:
+            if self.current is not None:
+                self.phases[self.current] = self.phases.get(self.current, 0) + now - self.entered
+                self.split(now)
+            self.current, self.entered = name, now
+
+    def split(self, now):
+        # charge the site running on this thread for time spent so far
+        code = getattr(self.local, 'site', None)
+        if code is not None:
+            phase = self.local.phase or self.current
+            times = self.sites.setdefault(code, {})
+            times[phase] = times.get(phase, 0) + now - self.local.start
+            self.local.start = now
+
+    @contextmanager
+    def site(self, code, phase=None):
+        # work on one site, optionally in a stage of its own
+        self.local.site, self.local.phase, self.local.start = code, phase, time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.split(time.perf_counter())
+            self.local.site = self.local.phase = None
+
+    def labels(self) -> tuple:
+        phase = getattr(self.local, 'phase', None) or self.current or 'other'
+        return phase, getattr(self.local, 'site', None) or ''
+
+    def response(self, r, *args, **kwargs):
+        # requests response hook; streamed bodies count by content-length
+        if kwargs.get('stream'):
+            size = int(r.headers.get('Content-Length', 0))
+        else:
+            size = len(r.content)
+        with self.lock:
+            stats = self.http.setdefault(self.labels(), { 'requests': 0, 'bytes': 0, 'latency': 0 })
+            stats['requests'] += 1
+            stats['bytes'] += size
+            stats['latency'] += r.elapsed.total_seconds()
+
+    def cache(self, kind, hit):
+        with self.lock:
+            stats = self.caches.setdefault(kind, { 'hits': 0, 'misses': 0 })
+            stats['hits' if hit else 'misses'] += 1
+
+    def report(self) -> dict:
+        with self.lock:
+            return {
+                'started': self.started,
+                'duration': time.time() - self.started,
+                'phases': dict(self.phases),
+                'sites': { code: dict(times) for code, times in self.sites.items() },
+                'http': [
+                    { 'phase': phase, 'site': site, **stats }
+                    for (phase, site), stats in sorted(self.http.items())
+                ],
+                'cache': { kind: dict(stats) for kind, stats in self.caches.items() }
+            }
+
+    def prometheus(self) -> str:
+        report = self.report()
+        lines = []
+
+        def metric(name, kind, helptext, samples):
+            lines.append(f'# HELP {name} {helptext}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                label = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f'{name}{{{label}}} {value}' if label else f'{name} {value}')
+
+        metric('noodle_last_run_timestamp_seconds', 'gauge', 'Start time of the last run.',
+            [ ({}, report['started']) ])
+        metric('noodle_run_duration_seconds', 'gauge', 'Wall time of the last run.',
+            [ ({}, report['duration']) ])
+        metric('noodle_phase_duration_seconds', 'gauge', 'Wall time per phase.',
+            [ ({ 'phase': p }, t) for p, t in report['phases'].items() ])
+        metric('noodle_site_phase_duration_seconds', 'gauge', 'Time spent per site and phase.',
+            [ ({ 'site': s, 'phase': p }, t) for s, times in report['sites'].items() for p, t in times.items() ])
+        for key, helptext in (('requests', 'HTTP requests made.'), ('bytes', 'HTTP response bytes received.'),
+                ('latency', 'Summed HTTP response latency in seconds.')):
+            metric(f'noodle_http_{key}', 'gauge', helptext,
+                [ ({ 'phase': h['phase'], 'site': h['site'] }, h[key]) for h in report['http'] ])
+        metric('noodle_cache_hits', 'gauge', 'Cache hits per cache.',
+            [ ({ 'cache': k }, c['hits']) for k, c in report['cache'].items() ])
+        metric('noodle_cache_misses', 'gauge', 'Cache misses per cache.',
+            [ ({ 'cache': k }, c['misses']) for k, c in report['cache'].items() ])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'report.json'), 'w') as f:
+            json.dump(self.report(), f, indent=4)
+
+        # textfile collectors must never see a partial file
+        tmp = os.path.join(path, 'noodle.prom.tmp')
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(tmp, os.path.join(path, 'noodle.prom'))
+
+
+def profile(func, path):
+    # run under cprofile and tracemalloc, keeping both captures; threads
+    # started meanwhile get a profiler of their own, merged at the end
+    import cProfile, pstats, tracemalloc
+    os.makedirs(path, exist_ok=True)
+    profilers = [ cProfile.Profile() ]
+
+    def thread(frame, event, arg):
+        # first event of a new thread; hand it over to its own profiler
+        profiler = cProfile.Profile()
+        profilers.append(profiler)
+        profiler.enable()
+
+    threading.setprofile(thread)
+    tracemalloc.start(16)
+    try:
+        profilers[0].runcall(func)
+    finally:
+        threading.setprofile(None)
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            profiler.create_stats()
+            if profiler.stats:
+                stats.add(profiler)
+        stats.dump_stats(os.path.join(path, 'profile.pstats'))
+        snapshot = tracemalloc.take_snapshot().filter_traces([ tracemalloc.Filter(False, cProfile.__file__) ])
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        with open(os.path.join(path, 'tracemalloc.txt'), 'w') as f:
+            f.write(f'current: {current} bytes, peak: {peak} bytes\n\n')
+            for stat in snapshot.statistics('lineno')[:50]:
+                f.write(f'{stat}\n')
@@ -0,0 +1,66 @@
+import re
+from hashlib import sha1
+
+from lxml import etree, html
+
+# markup selectors for the moodle pages noodle reads, compiled once
+
+# login and dashboard
+LOGIN_TOKEN = etree.XPath('//input[@name="logintoken"]/@value')
+USER_NAME = etree.XPath('//span[@class="usertext mr-1"]/text()')
+COURSES = etree.XPath('//div[@id="courses"]//div[contains(@id, "course-")]')
+COURSE_TYPE = etree.XPath('.//small/text()')
+COURSE_LINK = etree.XPath('.//strong/a/@href')
+
+# course page header
+SITE_HEADER = etree.XPath('./body/div/div/div/header')
+SITE_TITLE = etree.XPath('.//h1/text()')
+SITE_CODE = etree.XPath('.//a[@aria-current="page"]/text()')
+
+# course sections
+SECTIONS = etree.XPath('//li[@role="region"]/div[@class="content"]')
+SECTION_TITLE = etree.XPath('./h3//text()')
+SECTION_SUMMARY = etree.XPath('.//div[@class="summary"]')
+SECTION_MODULES = etree.XPath('./ul/li')
+
+# course modules
+MODULE_INSTANCE = etree.XPath('.//div[@class="activityinstance"]')
+MODULE_LINK = etree.XPath('.//a[@class="aalink"]')
+MODULE_TEXT = etree.XPath('.//text()')
+MODULE_DESC = etree.XPath('.//div[@class="contentafterlink"]')
+MODULE_DIMMED = etree.XPath('./div[contains(@class,"dimmed")]')
+MODULE_HREF = etree.XPath('./@href')
+
+# summary and description text
+DESC_TEXT = etree.XPath('.//div/text() | .//p//text() | .//ul/li//text()')
+
+# regions hashed for the site fingerprint
+FINGERPRINT = etree.XPath('./body/div/div/div/header | //li[@role="region"]')
+
+# module sub-pages
+RESOURCE_LINKS = etree.XPath('//section[@id="region-main"]/div[@role="main"]//a/@href')
+FOLDER_LINKS = etree.XPath('//div[@class="filemanager"]//a/@href')
+
+# everything from the page footer on is navigation and scripts
+PAGE_FOOTER = re.compile(rb'<footer[^>]*\bid="page-footer"')
+
+# markup that differs on every request: session keys and generated ids
+VOLATILE = re.compile(rb'sesskey(?:=|"\s*:\s*")\w+|yui_\w+')
+PAGE_BODY = re.compile(rb'<body\b')
+
+
+def parse_page(content):
+    # parse only up to the page footer; lxml closes the open elements
+    footer = PAGE_FOOTER.search(content)
+    if footer is not None:
+        content = content[:footer.start()]
+    return html.fromstring(content)
+
+
+def page_digest(content) -> str:
+    # hash of the page body up to the footer, without the markup that
+    # differs on every request; equal for pages that read the same
+    body = PAGE_BODY.search(content)
+    footer = PAGE_FOOTER.search(content)
+    content = content[body.start() if body is not None else 0:footer.start() if footer is not None else len(content)]
+    return sha1(VOLATILE.sub(b'', content)).hexdigest()
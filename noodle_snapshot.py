@@ -0,0 +1,49 @@
+import json
+
+# version of the snapshot format written to the history repo
+VERSION = 1
+
+
+def dumps(snapshot) -> bytes:
+    # canonical json without indentation; one value per line keeps the
+    # line stats of the history repo meaningful
+    data = { 'version': VERSION }
+    data.update(snapshot)
+    return json.dumps(data, ensure_ascii=False, indent=0, separators=(',', ':')).encode()
+
+
+def loads(data) -> dict:
+    snapshot = json.loads(data)
+
+    # blobs written before the snapshot format are jsonpickle objects
+    if 'py/object' in snapshot:
+        return migrate(snapshot)
+
+    if snapshot.pop('version', None) != VERSION:
+        raise ValueError('unsupported snapshot version')
+    return snapshot
+
+
+def migrate(obj) -> dict:
+    # unwrap py/tuple and py/object tags; py/id refers back to the n-th
+    # object in document order
+    objs = []
+
+    def plain(value):
+        if isinstance(value, list):
+            return [ plain(v) for v in value ]
+        if not isinstance(value, dict):
+            return value
+        if 'py/tuple' in value:
+            return plain(value['py/tuple'])
+        if 'py/id' in value:
+            return objs[value['py/id']]
+        ret = {}
+        if 'py/object' in value:
+            objs.append(ret)
+        for k, v in value.items():
+            if not k.startswith('py/'):
+                ret[k] = plain(v)
+        return ret
+
+    return plain(obj)
@@ -0,0 +1,167 @@
+import json
+import threading
+from hashlib import sha1
+from urllib.parse import urlencode, urlparse, parse_qs
+
+from lxml import html
+
+import noodle_selectors as sel
+
+# module type labels as the course page shows them
+LABELS = {
+    'resource': 'File',
+    'folder': 'Folder',
+    'assign': 'Assignment',
+    'page': 'Page',
+    'url': 'URL',
+    'forum': 'Forum',
+    'quiz': 'Quiz',
+    'book': 'Book',
+    'lti': 'External tool'
+}
+
+
+class Error(Exception):
+    # moodle turned the call down, e.g. for a course no longer enrolled in
+    pass
+
+
+class Unavailable(Error):
+    # web services cannot be used at all, e.g. they are off or the token
+    # is no longer valid
+    pass
+
+
+# error codes of calls turned down for the token or service, not the course
+UNAVAILABLE = { 'invalidtoken', 'accessexception', 'enablewsdescription', 'servicenotavailable', 'webservicesnotenabled' }
+
+
+def token(sess, moodle, username, password, service='moodle_mobile_app') -> str:
+    # exchange the credentials for a web service token
+    r = sess.post(moodle + '/login/token.php', data={ 'username': username, 'password': password, 'service': service })
+    try:
+        return r.json()['token']
+    except (ValueError, KeyError):
+        raise Unavailable('no web service token issued')
+
+
+def course_id(href) -> int:
+    return int(parse_qs(urlparse(href).query)['id'][0])
+
+
+def file_url(url) -> str:
+    # files are listed under the web service entry point, which wants the
+    # token in the query; the plain path works with the session cookies
+    # and matches the links on the module pages
+    return url.split('?')[0].replace('/webservice/pluginfile.php/', '/pluginfile.php/', 1)
+
+
+def text(markup, wrap) -> str:
+    # first text of formatted markup, as the course page shows it
+    if not markup:
+        return None
+    desc = sel.DESC_TEXT(html.fromstring(wrap.format(markup)))
+    return ' '.join(desc[0].split()) if len(desc) > 0 else None
+
+
+class Client:
+    def __init__(self, sess, moodle, token, archive=None):
+        # calls are recorded into the archive, or answered from a replayed
+        # one when there is no session
+        self.sess = sess
+        self.url = moodle + '/webservice/rest/server.php'
+        self.token = token
+        self.archive = archive
+        self.lock = threading.Lock()
+        self.courses = None
+
+        # sizes of the listed files by link, so downloads need not ask
+        self.sizes = {}
+
+    def call(self, function, **params):
+        key = f'ws/{function}?{urlencode(sorted(params.items()))}'
+        if self.sess is None:
+            content = self.archive.read(key)
+        else:
+            r = self.sess.post(self.url, data={
+                'wstoken': self.token,
+                'wsfunction': function,
+                'moodlewsrestformat': 'json',
+                **params
+            })
+            r.raise_for_status()
+            content = r.content
+            if self.archive is not None:
+                self.archive.record(key, content)
+        try:
+            data = json.loads(content)
+        except ValueError:
+            raise Unavailable(f'{function} did not return json')
+        if isinstance(data, dict) and 'exception' in data:
+            error = Unavailable if data.get('errorcode') in UNAVAILABLE else Error
+            raise error(data.get('message') or data['errorcode'])
+        return data
+
+    def enrolled(self) -> dict:
+        # courses of the signed-in user by id, fetched once
+        # every site needs the list, so failing to get it is not per course
+        with self.lock:
+            if self.courses is None:
+                try:
+                    user = self.call('core_webservice_get_site_info')['userid']
+                    courses = self.call('core_enrol_get_users_courses', userid=user)
+                except Unavailable:
+                    raise
+                except Error as e:
+                    raise Unavailable(str(e))
+                self.courses = { course['id']: course for course in courses }
+            return self.courses
+
+    def site(self, href) -> tuple:
+        # fingerprint, snapshot of the site without files, and the files of
+        # each module keyed by page, as resolve() takes them
+        course = self.enrolled().get(course_id(href))
+        if course is None:
+            raise Error(f'not enrolled in {href}')
+        contents = self.call('core_course_get_contents', courseid=course['id'])
+        digest = sha1(json.dumps([ course['fullname'], course['shortname'], contents ], sort_keys=True).encode())
+
+        sections = []
+        links = {}
+        for section in contents:
+            modules = []
+            for module in section['modules']:
+                # labels are text on the course page, not modules
+                if module['modname'] == 'label':
+                    continue
+
+                # set tags, as the course page labels and dims modules
+                tags = [ LABELS.get(module['modname'], module['modname'].capitalize()) ]
+                if not module.get('uservisible', True) or not module.get('visible', 1):
+                    tags.append('Restricted')
+                href = module.get('url', '#')
+
+                # set download-able files and folder sub files
+                files = []
+                for content in module.get('contents', ()):
+                    if content['type'] == 'file' and 'submission' not in content['fileurl']:
+                        files.append(file_url(content['fileurl']))
+                        if 'filesize' in content:
+                            self.sizes[files[-1]] = content['filesize']
+                if href != '#':
+                    links[href] = { 'files': files, 'folder': files }
+
+                modules.append({
+                    'title': module['name'].strip(),
+                    'desc': text(module.get('description'), '<div><div class="no-overflow">{}</div></div>'),
+                    'tags': ', '.join(tags),
+                    'href': href
+                })
+            sections.append({
+                'title': section['name'].strip(),
+                'desc': text(section.get('summary'), '<div class="no-overflow">{}</div>'),
+                'modules': modules
+            })
+
+        site = { 'title': course['fullname'].split(' ', 1)[1].strip(), 'code': course['shortname'].strip(), 'sections': sections }
+        return digest.hexdigest(), site, links